@@ -2,12 +2,17 @@ import sys
 import errno
 import logging
 import array
+import collections
 
 from ctypes import *
 import ctypes.util
 
 from ctypes.wintypes import *
-import winreg as wr
+
+try:
+    import winreg as wr
+except ImportError:
+    wr = None   # non-Windows host (module usable only with substituted _lib)
 
 _internal_module = False
 try:
@@ -86,9 +91,18 @@ ERROR_SUCCESS = 0
 ERROR_HANDLE_EOF = 38
 ERROR_INSUFFICIENT_BUFFER = 122
 ERROR_NO_MORE_ITEMS = 259
+ERROR_OPERATION_ABORTED = 995
 ERROR_IO_INCOMPLETE = 996
 ERROR_IO_PENDING = 997
 
+INFINITE = 0xFFFFFFFF
+
+def _win_error(code):
+    try:
+        return WinError(code)
+    except NameError:   # non-Windows host
+        return OSError(code, f'Windows error {code}')
+
 
 class GUID(Structure):
     _fields_ = [
@@ -307,6 +321,10 @@ def _setup_prototypes(lib):
     ]
     lib.CreateFileA.restype = HANDLE
 
+    lib.GetLastError = windll.kernel32.GetLastError
+    lib.GetLastError.argtypes = [ ]
+    lib.GetLastError.restype = DWORD
+
     lib.CloseHandle = windll.kernel32.CloseHandle
     lib.CloseHandle.argtypes = [ HANDLE ]
     lib.CloseHandle.restype = BOOL
@@ -428,6 +446,16 @@ class _DeviceHandle(object):
         self.oRead.hEvent = _lib.CreateEventA(None, TRUE, FALSE, None)
         self.oWrite = OVERLAPPED()
         self.oWrite.hEvent = _lib.CreateEventA(None, TRUE, FALSE, None)
+        self.oWriteRing = [ ]   # for pipelined writes
+
+    def get_write_ring(self, num):
+        while len(self.oWriteRing) < num:
+            ovl = OVERLAPPED()
+            ovl.hEvent = _lib.CreateEventA(None, TRUE, FALSE, None)
+            if not ovl.hEvent:
+                raise RuntimeError(f'Cannot create event for overlapped write! Error: {_win_error(_lib.GetLastError())}')
+            self.oWriteRing.append(ovl)
+        return self.oWriteRing[:num]
 
     def __del__(self):
         if self.hdev:
@@ -435,6 +463,8 @@ class _DeviceHandle(object):
 
         _lib.CloseHandle(self.oRead.hEvent)
         _lib.CloseHandle(self.oWrite.hEvent)
+        for ovl in self.oWriteRing:
+            _lib.CloseHandle(ovl.hEvent)
 
 class _GordonGateUsb(backend.IBackend):
     @methodtrace(_logger)
@@ -723,6 +753,71 @@ class _GordonGateUsb(backend.IBackend):
         
         return pos
 
+    @methodtrace(_logger)
+    def bulk_write_async(self, dev_handle, ep, intf, data, timeout, transfer_size, num_transfers):
+        payload, bufsize = data.buffer_info()
+        if num_transfers <= 1 or transfer_size <= 0 or bufsize <= transfer_size:
+            return self.bulk_write(dev_handle, ep, intf, data, timeout)
+
+        hdev = dev_handle.hdev
+        free = collections.deque(dev_handle.get_write_ring(num_transfers))
+        pending = collections.deque()   # queued writes: (ovl, size)
+        pos = 0
+        done = 0
+        try:
+            while done < bufsize:
+                while free and pos < bufsize:
+                    ovl = free.popleft()
+                    bsz = transfer_size if pos + transfer_size <= bufsize else bufsize - pos
+                    self._start_overlapped_write(hdev, ovl, payload + pos, bsz)
+                    pending.append( (ovl, bsz) )
+                    pos += bsz
+
+                ovl, bsz = pending[0]
+                nbytes = self._get_overlapped_result(hdev, ovl, timeout)
+                pending.popleft()
+                free.append(ovl)
+                if nbytes != bsz:
+                    raise USBError(f'USB Write incomplete! size = {nbytes}, expected: {bsz}', 9900078, 9900078)
+                done += nbytes
+        finally:
+            if pending:
+                _lib.CancelIo(hdev)
+                # buffer and OVERLAPPED structs must stay valid until all queued requests are completed
+                for ovl, bsz in pending:
+                    _lib.WaitForSingleObject(ovl.hEvent, INFINITE)
+
+        return done
+
+    def _start_overlapped_write(self, hdev, ovl, addr, size):
+        ovl.Internal = 0
+        ovl.InternalHigh = 0
+        ovl.Offset = 0
+        ovl.OffsetHigh = 0
+        _lib.ResetEvent(ovl.hEvent)
+        rc = _lib.WriteFile(hdev, LPVOID(addr), size, None, byref(ovl))
+        if rc == FALSE:
+            dwErr = _lib.GetLastError()
+            if dwErr != ERROR_IO_PENDING:
+                raise RuntimeError(f"Error [{dwErr}]: {_win_error(dwErr)}")
+        # on synchronous completion the event is signaled too
+
+    def _get_overlapped_result(self, hdev, ovl, timeout):
+        dwWait = _lib.WaitForSingleObject(ovl.hEvent, timeout)
+        if dwWait != WAIT_OBJECT_0:
+            if dwWait == WAIT_TIMEOUT:
+                raise USBTimeoutError(f'WAIT_TIMEOUT', dwWait, dwWait)
+            raise USBError(f'{_win_error(_lib.GetLastError())}', dwWait, dwWait)
+
+        nBytes = DWORD(0)
+        rc = _lib.GetOverlappedResult(hdev, byref(ovl), byref(nBytes), FALSE)
+        if rc == FALSE:
+            dwErr = _lib.GetLastError()
+            if dwErr == ERROR_OPERATION_ABORTED:
+                raise RuntimeError(f"ERROR_OPERATION_ABORTED: {_win_error(dwErr)}")
+            raise RuntimeError(f"Error <{dwErr}>: {_win_error(dwErr)}")
+        return nBytes.value
+
     @methodtrace(_logger)
     def bulk_read(self, dev_handle, ep, intf, buff, timeout):
         payload, bufsize = buff.buffer_info()
@@ -830,6 +925,35 @@ def get_value(key, vname):
         return None
     return data
 
+def get_usb_instance_id(dev):
+    # instance id of device (part of device interface path) by USB port number
+    dev_path = f'SYSTEM\\CurrentControlSet\\Enum\\USB\\VID_{dev.idVendor:04X}&PID_{dev.idProduct:04X}'
+    access = wr.KEY_READ | wr.KEY_QUERY_VALUE | wr.KEY_ENUMERATE_SUB_KEYS
+    if dev.port_number is None:
+        return None
+    try:
+        key = wr.OpenKeyEx(wr.HKEY_LOCAL_MACHINE, dev_path, access = access)
+    except OSError:
+        return None
+
+    inst_id = None
+    for sk_name in get_sub_keys(key):
+        key1 = wr.OpenKeyEx(wr.HKEY_LOCAL_MACHINE, dev_path + '\\' + sk_name, access = access)
+        drv_loc_info = get_value(key1, 'LocationInformation')
+        wr.CloseKey(key1)
+        if not drv_loc_info:
+            continue
+        pk = drv_loc_info.find('Port_#')
+        if pk < 0:
+            continue
+        pk += 6
+        if int(drv_loc_info[pk:pk+4], 16) == dev.port_number:
+            if inst_id is not None:
+                return None  # second key founded
+            inst_id = sk_name
+    wr.CloseKey(key)
+    return inst_id
+
 def get_usb_driver_info(dev):
     dev_path = f'SYSTEM\\CurrentControlSet\\Enum\\USB\\VID_{dev.idVendor:04X}&PID_{dev.idProduct:04X}'
     access = wr.KEY_READ | wr.KEY_QUERY_VALUE | wr.KEY_ENUMERATE_SUB_KEYS
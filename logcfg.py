@@ -46,6 +46,8 @@ LOGGING_CONFIG = {
 
 log = None
 _init_time = None
+basedir = os.path.dirname(__file__)
+logsdir = os.path.join(basedir, "logs")
 
 def _set_log_level(level, hnum = 1):
     log.handlers[hnum].setLevel(level)
@@ -56,6 +58,26 @@ def get_logger():
     _log.warn = _log.warning
     return _log
 
+def get_log_filename(suffix = '', ext = '.log'):
+    return os.path.join(logsdir, f"sxf__{_init_time}{suffix}{ext}")
+
+def redirect_to_file(log_file, console = False):
+    # used by worker processes: each worker writes to own log file
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+
+    os.makedirs(os.path.dirname(log_file), exist_ok = True)
+    fh = logging.FileHandler(log_file)
+    fh.setFormatter(logging.Formatter(LOGGING_CONFIG['formatters']['for_files']['format']))
+    fh.setLevel(logging.DEBUG)
+    ch = logging.StreamHandler(sys.stdout) if console else logging.NullHandler()
+    ch.setFormatter(logging.Formatter(LOGGING_CONFIG['formatters']['for_stdout']['format']))
+    ch.setLevel(logging.ERROR)
+    log.addHandler(fh)
+    log.addHandler(ch)   # handlers[1] is controlled by log.set_level()
+    log.propagate = False
+    log.setLevel(logging.DEBUG)
+
 
 try:  
     _init_time = os.environ["SXF_INIT_TIME"]
@@ -67,12 +89,10 @@ except KeyError:
 if _init_time is not None:
     log = get_logger()
 else:
-    basedir = os.path.dirname(__file__)
-    logsdir = os.path.join(basedir, "logs")
     os.makedirs(logsdir, exist_ok = True)
     
     _init_time = datetime.now().strftime('%Y-%m-%d__%H-%M-%S')
-    log_file = os.path.join(logsdir, f"sxf__{_init_time}.log")
+    log_file = get_log_filename()
 
     os.environ["SXF_INIT_TIME"] = _init_time
 
@@ -35,6 +35,7 @@
 
 import sys
 import array
+import ctypes
 
 __all__ = ['_reduce', '_set', '_next', '_update_wrapper']
 
@@ -98,3 +99,89 @@ def as_array(data=None):
         a = array.array('B')
         a.frombytes(data.encode('utf-8'))
         return a
+
+# Py_buffer struct (see Include/pybuffer.h)
+class _Py_buffer(ctypes.Structure):
+    _fields_ = [('buf', ctypes.c_void_p),
+                ('obj', ctypes.c_void_p),
+                ('len', ctypes.c_ssize_t),
+                ('itemsize', ctypes.c_ssize_t),
+                ('readonly', ctypes.c_int),
+                ('ndim', ctypes.c_int),
+                ('format', ctypes.c_char_p),
+                ('shape', ctypes.POINTER(ctypes.c_ssize_t)),
+                ('strides', ctypes.POINTER(ctypes.c_ssize_t)),
+                ('suboffsets', ctypes.POINTER(ctypes.c_ssize_t)),
+                ('internal', ctypes.c_void_p)]
+
+_PyBUF_SIMPLE = 0
+_PyBUF_WRITABLE = 0x0001
+
+try:
+    _PyObject_GetBuffer = ctypes.pythonapi.PyObject_GetBuffer
+    _PyObject_GetBuffer.argtypes = [ctypes.py_object, ctypes.POINTER(_Py_buffer), ctypes.c_int]
+    _PyObject_GetBuffer.restype = ctypes.c_int
+    _PyBuffer_Release = ctypes.pythonapi.PyBuffer_Release
+    _PyBuffer_Release.argtypes = [ctypes.POINTER(_Py_buffer)]
+    _PyBuffer_Release.restype = None
+except (AttributeError, OSError):
+    _PyObject_GetBuffer = None
+
+class _BufferRef(object):
+    r"""Zero-copy wrapper of an object supporting the buffer protocol.
+
+    It exposes the buffer_info() method and the itemsize attribute, so it
+    can be passed to the backends in place of an array object. The wrapped
+    object is referenced to keep the memory alive.
+    """
+    itemsize = 1
+
+    def __init__(self, obj, address, length):
+        self.obj = obj
+        self.address = address
+        self.length = length
+
+    def buffer_info(self):
+        return self.address, self.length
+
+    def __len__(self):
+        return self.length
+
+    def tobytes(self):
+        return ctypes.string_at(self.address, self.length)
+
+def as_buffer(data=None, writable=False):
+    r"""Return an array-like object for data without copying it.
+
+    Objects supporting the buffer protocol (bytes, bytearray, memoryview,
+    mmap, ...) are wrapped in place, all other sequences are converted
+    with as_array().
+    """
+    if data is None or isinstance(data, (array.array, _BufferRef)):
+        return as_array(data)
+
+    if _PyObject_GetBuffer is None or isinstance(data, str):
+        return as_array(data)
+
+    try:
+        mv = memoryview(data)
+    except TypeError:
+        return as_array(data)
+
+    if writable and mv.readonly:
+        raise TypeError('Buffer object is read-only')
+
+    pb = _Py_buffer()
+    flags = _PyBUF_WRITABLE if writable else _PyBUF_SIMPLE
+    try:
+        _PyObject_GetBuffer(mv, ctypes.byref(pb), flags)
+    except BufferError:
+        # non-contiguous buffer
+        if writable:
+            raise
+        return as_array(mv.tobytes())
+    try:
+        # memoryview object holds its own export, so address remains valid
+        return _BufferRef(mv, pb.buf or 0, pb.len)
+    finally:
+        _PyBuffer_Release(ctypes.byref(pb))
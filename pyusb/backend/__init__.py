@@ -267,6 +267,20 @@ class IBackend(_objfinalizer.AutoFinalizedObject):
         """
         _not_implemented(self.bulk_read)
 
+    def bulk_write_async(self, dev_handle, ep, intf, data, timeout,
+                         transfer_size, num_transfers):
+        r"""Perform a bulk write keeping several transfers in flight.
+
+        The parameters dev_handle, ep, intf, data and timeout are the same
+        as for the bulk_write() method, the timeout is applied to each
+        transfer. The data is split into transfers of transfer_size bytes
+        and up to num_transfers of them are queued at once, so the device
+        does not idle between them.
+
+        The method returns the number of bytes written.
+        """
+        _not_implemented(self.bulk_write_async)
+
     def intr_write(self, dev_handle, ep, intf, data, timeout):
         r"""Perform an interrupt write.
 
@@ -37,6 +37,7 @@ from .. import _interop
 from .. import _objfinalizer
 import errno
 import math
+import time
 from ..core import USBError, USBTimeoutError
 from .. import libloader
 from .. import backend
@@ -246,6 +247,10 @@ class _libusb_iso_packet_descriptor(Structure):
 
 _libusb_device_handle = c_void_p
 
+class _libusb_timeval(Structure):
+    _fields_ = [('tv_sec', c_long),
+                ('tv_usec', c_long)]
+
 class _libusb_transfer(Structure):
     pass
 _libusb_transfer_p = POINTER(_libusb_transfer)
@@ -482,6 +487,9 @@ def _setup_prototypes(lib):
     # int libusb_submit_transfer(struct libusb_transfer *transfer);
     lib.libusb_submit_transfer.argtypes = [POINTER(_libusb_transfer)]
 
+    # int libusb_cancel_transfer(struct libusb_transfer *transfer);
+    lib.libusb_cancel_transfer.argtypes = [POINTER(_libusb_transfer)]
+
     if hasattr(lib, 'libusb_strerror'):
         # const char *libusb_strerror(enum libusb_error errcode)
         lib.libusb_strerror.argtypes = [c_uint]
@@ -553,6 +561,33 @@ def _setup_prototypes(lib):
         transfer.callback = callback
     lib.libusb_fill_iso_transfer = libusb_fill_iso_transfer
 
+    # void libusb_fill_bulk_transfer(
+    #               struct libusb_transfer* transfer,
+    #               libusb_device_handle*  dev_handle,
+    #               unsigned char endpoint,
+    #               unsigned char* buffer,
+    #               int length,
+    #               libusb_transfer_cb_fn   callback,
+    #               void * user_data,
+    #               unsigned int timeout
+    #           );
+    def libusb_fill_bulk_transfer(_libusb_transfer_p, dev_handle, endpoint, buffer, length,
+                                  callback, user_data, timeout):
+        r"""This function is inline in the libusb.h file, so we must implement
+            it.
+        """
+        transfer = _libusb_transfer_p.contents
+        transfer.dev_handle = dev_handle
+        transfer.endpoint = endpoint
+        transfer.type = _LIBUSB_TRANSFER_TYPE_BULK
+        transfer.timeout = timeout
+        transfer.buffer = cast(buffer, c_void_p)
+        transfer.length = length
+        transfer.num_iso_packets = 0
+        transfer.user_data = user_data
+        transfer.callback = callback
+    lib.libusb_fill_bulk_transfer = libusb_fill_bulk_transfer
+
     # uint8_t libusb_get_bus_number(libusb_device *dev)
     lib.libusb_get_bus_number.argtypes = [c_void_p]
     lib.libusb_get_bus_number.restype = c_uint8
@@ -591,6 +626,13 @@ def _setup_prototypes(lib):
     #int libusb_handle_events(libusb_context *ctx);
     lib.libusb_handle_events.argtypes = [c_void_p]
 
+    #int libusb_handle_events_timeout(libusb_context *ctx,
+    #                                 struct timeval *tv);
+    lib.libusb_handle_events_timeout.argtypes = [
+            c_void_p,
+            POINTER(_libusb_timeval)
+        ]
+
 # check a libusb function call
 def _check(ret):
     if hasattr(ret, 'value'):
@@ -650,6 +692,7 @@ class _DeviceHandle(object):
     def __init__(self, dev):
         self.handle = _libusb_device_handle()
         self.devid = dev.devid
+        self.bulk_queues = {}   # ep => _BulkTransferQueue
         _check(_lib.libusb_open(self.devid, byref(self.handle)))
 
 class _IsoTransferHandler(_objfinalizer.AutoFinalizedObject):
@@ -708,6 +751,122 @@ class _IsoTransferHandler(_objfinalizer.AutoFinalizedObject):
     def __callback(self, transfer):
         self.__callback_done = 1
 
+# keeps several bulk transfers in flight on one endpoint
+class _BulkTransferQueue(_objfinalizer.AutoFinalizedObject):
+    # ring of transfers allocated once per endpoint and reused by every submit
+    cancel_timeout = 1.0    # seconds to reap cancelled transfers
+
+    def __init__(self, dev_handle, ep):
+        self.dev_handle = dev_handle
+        self.ep = ep
+        self.__callback_p = _libusb_transfer_cb_fn_p(self.__callback)
+        self.__completed = []
+        self.transfers = []
+
+    def _alloc(self, num_transfers):
+        while len(self.transfers) < num_transfers:
+            transfer = _lib.libusb_alloc_transfer(0)
+            if not transfer:
+                raise USBError(_strerror(LIBUSB_ERROR_NO_MEM),
+                               LIBUSB_ERROR_NO_MEM,
+                               _libusb_errno[LIBUSB_ERROR_NO_MEM])
+            self.transfers.append(transfer)
+
+    def _finalize_object(self):
+        for transfer in self.transfers:
+            _lib.libusb_free_transfer(transfer)
+        self.transfers = []
+
+    def submit(self, address, length, transfer_size, num_transfers, timeout, ctx = None):
+        self._alloc(max(1, num_transfers))
+        free = self.transfers[:max(1, num_transfers)]
+        inflight = {}
+        self.__completed = []
+        pos = 0
+        total = 0
+        error = None
+        cancelled = False
+        # libusb enforces timeout of each transfer; deadline guards against failed event handling
+        limit = timeout / 1000.0 + self.cancel_timeout if timeout else None
+        deadline = time.monotonic() + limit if limit else None
+        tv = _libusb_timeval(0, 100000)
+
+        while True:
+            while free and pos < length and error is None:
+                transfer = free.pop()
+                size = min(transfer_size, length - pos)
+                _lib.libusb_fill_bulk_transfer(transfer,
+                                               self.dev_handle.handle,
+                                               self.ep,
+                                               address + pos,
+                                               size,
+                                               self.__callback_p,
+                                               None,
+                                               timeout)
+                ret = _lib.libusb_submit_transfer(transfer)
+                if ret < 0:
+                    free.append(transfer)
+                    error = (ret, None)
+                    break
+                inflight[addressof(transfer.contents)] = transfer
+                pos += size
+
+            if not inflight:
+                break
+
+            if error is not None and not cancelled:
+                for transfer in inflight.values():
+                    _lib.libusb_cancel_transfer(transfer)
+                cancelled = True
+                deadline = time.monotonic() + self.cancel_timeout
+
+            if not self.__completed:
+                if deadline is not None and time.monotonic() > deadline:
+                    if not cancelled:
+                        error = (LIBUSB_ERROR_TIMEOUT, None)
+                        continue
+                    # transfers are not reaped: buffer may be still in use, drop them from ring
+                    lost = set(inflight.keys())
+                    self.transfers = [t for t in self.transfers if addressof(t.contents) not in lost]
+                    break
+                ret = _lib.libusb_handle_events_timeout(ctx, byref(tv))
+                if ret < 0 and ret != LIBUSB_ERROR_INTERRUPTED and error is None:
+                    # in-flight transfers are cancelled on the next iteration
+                    error = (ret, None)
+
+            while self.__completed:
+                transfer = inflight.pop(self.__completed.pop(0), None)
+                if transfer is None:
+                    continue  # late callback of transfer dropped from ring
+                free.append(transfer)
+                if limit and not cancelled:
+                    deadline = time.monotonic() + limit
+                t = transfer.contents
+                if t.status != LIBUSB_TRANSFER_COMPLETED:
+                    if error is None:
+                        error = (None, int(t.status))
+                    continue
+                total += t.actual_length
+                if t.actual_length != t.length and error is None:
+                    error = (LIBUSB_ERROR_IO, None)
+
+        if error is not None:
+            ret, status = error
+            if ret is not None:
+                _check(ret)
+            if status == LIBUSB_TRANSFER_TIMED_OUT:
+                raise USBTimeoutError(_str_transfer_error[status],
+                                      status,
+                                      _transfer_errno[status])
+            raise USBError(_str_transfer_error[status],
+                           status,
+                           _transfer_errno[status])
+
+        return total
+
+    def __callback(self, transfer):
+        self.__completed.append(addressof(transfer.contents))
+
 # implementation of libusb 1.0 backend
 class _LibUSB(backend.IBackend):
     @methodtrace(_logger)
@@ -806,6 +965,7 @@ class _LibUSB(backend.IBackend):
 
     @methodtrace(_logger)
     def close_device(self, dev_handle):
+        dev_handle.bulk_queues.clear()
         self.lib.libusb_close(dev_handle.handle)
 
     @methodtrace(_logger)
@@ -851,6 +1011,16 @@ class _LibUSB(backend.IBackend):
                            buff,
                            timeout)
 
+    @methodtrace(_logger)
+    def bulk_write_async(self, dev_handle, ep, intf, data, timeout,
+                         transfer_size, num_transfers):
+        address, length = data.buffer_info()
+        length *= data.itemsize
+        queue = dev_handle.bulk_queues.get(ep)
+        if queue is None:
+            queue = dev_handle.bulk_queues[ep] = _BulkTransferQueue(dev_handle, ep)
+        return queue.submit(address, length, transfer_size, num_transfers, timeout, self.ctx)
+
     @methodtrace(_logger)
     def intr_write(self, dev_handle, ep, intf, data, timeout):
         return self.__write(self.lib.libusb_interrupt_transfer,
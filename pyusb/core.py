@@ -969,7 +969,9 @@ class Device(_objfinalizer.AutoFinalizedObject):
         communicate with.
 
         The data parameter should be a sequence like type convertible to
-        the array type (see array module).
+        the array type (see array module). Objects supporting the buffer
+        protocol (bytes, bytearray, memoryview) are passed to the backend
+        without copying.
 
         The timeout is specified in miliseconds.
 
@@ -990,10 +992,40 @@ class Device(_objfinalizer.AutoFinalizedObject):
                 self._ctx.handle,
                 ep.bEndpointAddress,
                 intf.bInterfaceNumber,
-                _interop.as_array(data),
+                _interop.as_buffer(data),
                 self.__get_timeout(timeout)
             )
 
+    def write_async(self, endpoint, data, timeout = None,
+                    transfer_size = 0x10000, num_transfers = 4):
+        r"""Write data to the bulk endpoint keeping several transfers in flight.
+
+        The data is split into transfers of transfer_size bytes (it should
+        be a multiple of the endpoint wMaxPacketSize) and up to num_transfers
+        of them are queued at once, so the device does not idle between
+        packets. The other parameters are the same as for the write() method.
+
+        If the backend does not support asynchronous transfers, the
+        NotImplementedError exception is raised.
+
+        The method returns the number of bytes written.
+        """
+        backend = self._ctx.backend
+
+        intf, ep = self._ctx.setup_request(self, endpoint)
+        if util.endpoint_type(ep.bmAttributes) != util.ENDPOINT_TYPE_BULK:
+            raise ValueError('Asynchronous write supported only for bulk endpoints')
+
+        return backend.bulk_write_async(
+                self._ctx.handle,
+                ep.bEndpointAddress,
+                intf.bInterfaceNumber,
+                _interop.as_buffer(data),
+                self.__get_timeout(timeout),
+                transfer_size,
+                num_transfers
+            )
+
     def read(self, endpoint, size_or_buffer, timeout = None):
         r"""Read data from the endpoint.
 
@@ -1001,13 +1033,15 @@ class Device(_objfinalizer.AutoFinalizedObject):
         parameter corresponds to the bEndpointAddress member whose endpoint
         you want to communicate with. The size_or_buffer parameter either
         tells how many bytes you want to read or supplies the buffer to
-        receive the data (it *must* be an object of the type array).
+        receive the data (it *must* be an object of the type array or a
+        writable object supporting the buffer protocol, like bytearray or
+        memoryview).
 
         The timeout is specified in miliseconds.
 
         If the size_or_buffer parameter is the number of bytes to read, the
         method returns an array object with the data read. If the
-        size_or_buffer parameter is an array object, it returns the number
+        size_or_buffer parameter is a buffer object, it returns the number
         of bytes actually read.
         """
         backend = self._ctx.backend
@@ -1023,8 +1057,10 @@ class Device(_objfinalizer.AutoFinalizedObject):
 
         if isinstance(size_or_buffer, array.array):
             buff = size_or_buffer
-        else: # here we consider it is a integer
+        elif isinstance(size_or_buffer, int):
             buff = util.create_buffer(size_or_buffer)
+        else: # read inplace into writable buffer object
+            buff = _interop.as_buffer(size_or_buffer, writable = True)
 
         ret = fn(
                 self._ctx.handle,
@@ -1033,7 +1069,7 @@ class Device(_objfinalizer.AutoFinalizedObject):
                 buff,
                 self.__get_timeout(timeout))
 
-        if isinstance(size_or_buffer, array.array):
+        if not isinstance(size_or_buffer, int):
             return ret
         elif ret != len(buff) * buff.itemsize:
             return buff[:ret]
@@ -16,6 +16,7 @@ class SimUnlock():
         self.sud = sud
         if not self.sud:
             self.sud = somcusb.SomcUsbDevice(loglevel = loglevel)
+        self.sud.use_ta_cache = True
 
     def connect(self):
         sud = self.sud
@@ -24,28 +25,11 @@ class SimUnlock():
         
     def init_vars(self):
         sud = self.sud
-        self.root_key_hash = sud.command('Get-root-key-hash')   # PLF_ROOT_HASH
-        self.loader_ver = sud.getvar('Loader-version')
-        self.phone_id = sud.getvar('Phone-id')
-        self.device_id = sud.getvar('Device-id')
-        self.rooting_status = sud.getvar('Rooting-status')  # Reading 325 bytes from RPMB, OK + Reading 325 bytes from RPMB, OK
-        self.sector_size = sud.getvar('Sector-size', 'int')
-        self.ufs_info = sud.getvar('Ufs-info')
-        self.emmc_info = sud.getvar('Emmc-info')
-        self.def_security = sud.getvar('Default-security')
-        self.platform_id = sud.getvar('Platform-id')
-        self.keystore_counter = sud.getvar('Keystore-counter', 'int')  # Reading 325 bytes from RPMB, OK
-        self.security_state = sud.getvar('Security-state')             # Reading 325 bytes from RPMB, OK
-        self.s1_root = sud.getvar('S1-root')
-        self.sake_root = sud.getvar('Sake-root')    # Reading 325 bytes from RPMB, OK
-        self.battery_level = sud.getvar('Battery', 'int')
-        sud.getvar('Frp-partition')
-        sud.getvar('Stored-security-state')   # Reading 325 bytes from RPMB, OK
-        sud.getvar('Keystore-xcs')            # Reading 325 bytes from RPMB, OK
-        sud.getvar('X-conf')
-        sud.getvar('Soc-unique-id')
-        self.blver = sud.getvar('version-bootloader')
-        self.serialno = sud.getvar('serialno')
+        self.devinfo = info = sud.get_device_info()
+        for name in [ 'root_key_hash', 'loader_ver', 'phone_id', 'device_id', 'rooting_status', 'sector_size',
+                      'ufs_info', 'emmc_info', 'def_security', 'platform_id', 'keystore_counter',
+                      'security_state', 's1_root', 'sake_root', 'battery_level', 'blver', 'serialno' ]:
+            setattr(self, name, getattr(info, name))
 
     def magic_func_001(self, simlock_sign, simlock, hw_conf):
         # FIXME
@@ -82,31 +66,7 @@ class SimUnlock():
         txt = sud.dump_xbl_log(save_to_file = False)  # LAST_BOOT_LOG
         txt = sud.dump_xbl_log(save_to_file = False)  # LAST_BOOT_LOG
         
-        max_download_size = int(sud.getvar('max-download-size'))
-        product = sud.getvar('product')
-        version = sud.getvar('version')
-        blver = sud.getvar('version-bootloader')
-        bbver = sud.getvar('version-baseband')
-        serialno = sud.getvar('serialno')
-        secure = sud.getvar('secure')
-        sector_size = sud.getvar('Sector-size', 'int')
-        loader_ver = sud.getvar('Loader-version')
-        phone_id = sud.getvar('Phone-id')
-        device_id = sud.getvar('Device-id')
-        platform_id = sud.getvar('Platform-id')
-        rooting_status = sud.getvar('Rooting-status')  # Reading 325 bytes from RPMB, OK + Reading 325 bytes from RPMB, OK
-        ufs_info = sud.getvar('Ufs-info')
-        emmc_info = sud.getvar('Emmc-info')
-        def_security = sud.getvar('Default-security')
-        keystore_counter = sud.getvar('Keystore-counter', 'int')  # Reading 325 bytes from RPMB, OK
-        security_state = sud.getvar('Security-state')        # Reading 325 bytes from RPMB, OK
-        s1_root = sud.getvar('S1-root')
-        sake_root = sud.getvar('Sake-root')    # Reading 325 bytes from RPMB, OK
-        root_key_hash = sud.command('Get-root-key-hash')   # PLF_ROOT_HASH
-        
-        slot_count = sud.getvar('slot-count', 'int')
-        current_slot = sud.getvar('current-slot')
-        battery_level = sud.getvar('Battery', 'int')
+        info = sud.get_device_info()
         
         if not self.test:
             ret = sud.write_ta('FLASH_MODE', b'\x01')  # [2:10100]
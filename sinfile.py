@@ -0,0 +1,902 @@
+import os
+import sys
+from os import path as osp
+
+import time
+import json
+import mmap
+import gzip
+import hashlib
+import tempfile
+import zlib
+import queue
+import tarfile
+import threading
+
+import logging
+from logcfg import log
+
+import somcta as ta
+
+
+class _ReaderClosed(Exception):
+    pass
+
+
+class SinChunk():
+    def __init__(self, reader, name, size, num):
+        self.reader = reader
+        self.name = name
+        self.size = size
+        self.num = num      # -1 = CMS
+        self.data = None    # payload of CMS
+        self.view = None    # memoryview of mapped chunk data
+        self._eof = num < 0
+
+    def __iter__(self):
+        if self.view is not None:
+            wsize = self.reader.window_size
+            for pos in range(0, self.size, wsize):
+                yield self.view[pos:pos+wsize]
+            return
+        # yields buffers of chunk data prefetched by background thread
+        while not self._eof:
+            buf = self.reader._get()
+            if buf is None:
+                self._eof = True
+                break
+            yield buf
+
+    def skip(self):
+        if self.view is None:
+            for buf in self:
+                pass
+
+
+class SinReader():
+    _END = object()
+
+    def __init__(self, filename, max_download_size, window_size = 1024*1024, prefetch = 8, info = None, chunk_cache = None, mapped = None, use_mmap = True):
+        self.filename = filename
+        self.sinfn = osp.basename(filename)
+        self.max_download_size = max_download_size
+        self.window_size = window_size
+        self.imgname = None
+        self.info = info  # manifest of SIN-file (see scan_sin)
+        self.chunk_cache = chunk_cache
+        self.mapped = mapped  # { 'imgname', 'chunks': [ (name, memoryview), ... ] } (CMS is first)
+        self.use_mmap = use_mmap  # map uncompressed SIN-file into memory
+        self._file = None
+        self._mm = None
+        self._tar = None
+        self._filler = None
+        self.queue = queue.Queue(maxsize = prefetch)
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        self.thread = threading.Thread(target = self._worker, name = f'SinReader:{self.sinfn}', daemon = True)
+        self.thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        if self._filler:
+            self._filler.stop()
+            self._filler = None
+        if self._mm:
+            self.mapped = None
+            try:
+                self._mm.close()
+            except BufferError:
+                pass  # chunk views still alive, mapping will be released by GC
+            self._mm = None
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __iter__(self):
+        chunk = None
+        while True:
+            if chunk:
+                chunk.skip()  # consumer not read all chunk data
+            item = self._get()
+            if item is self._END:
+                break
+            chunk = item
+            yield chunk
+
+    def _get(self):
+        item = self.queue.get()
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def _put(self, item):
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout = 0.1)
+                return True
+            except queue.Full:
+                pass
+        raise _ReaderClosed()
+
+    def _worker(self):
+        try:
+            if not self.mapped and self.use_mmap and not is_gzip_file(self.filename):
+                self.mapped = self._map_tar()
+            if self.mapped:
+                self._read_mapped_chunks()
+            elif self.chunk_cache and self.info and self.info['gzip']:
+                self._read_cached_chunks()
+            else:
+                self._read_chunks()
+            self._put(self._END)
+        except _ReaderClosed:
+            pass
+        except BaseException as e:
+            try:
+                self._put(e)
+            except _ReaderClosed:
+                pass
+
+    def _read_chunks(self):
+        sinfn = self.sinfn
+        with tarfile.open(self.filename) as tar:
+            num = -2
+            for member in tar:
+                if member.type != tarfile.REGTYPE:
+                    continue  # process only regular files
+
+                fn = member.name
+                stream = tar.extractfile(member)
+                if stream is None:  # process only regular files
+                    continue
+
+                cname = f'{sinfn}/{fn}'
+                dsize = member.size
+                if dsize >= self.max_download_size:
+                    raise RuntimeError(f'Chunk "{cname}" very large! Size = {dsize}, max = {self.max_download_size}')
+
+                if dsize == 0:
+                    raise RuntimeError(f'Chunk "{cname}" is empty! Size = {dsize}')
+
+                num += 1
+                chunk = SinChunk(self, fn, dsize, num)
+                if num == -1:  # CMS
+                    self.imgname = osp.splitext(fn)[0]
+                    if not fn.endswith('.cms'):
+                        raise RuntimeError(f'File "{cname}" contain incorrect CMS (ext)')
+
+                    data = stream.read()
+                    if data[0:2] != b'\x30\x82':
+                        raise RuntimeError(f'File "{cname}" contain incorrect CMS (magic)')
+
+                    chunk.data = data
+                    self._put(chunk)
+                    continue
+
+                if osp.splitext(fn)[0] != self.imgname:
+                    raise RuntimeError(f'File "{sinfn}" contain incorrect filename: "{fn}", expected: "{self.imgname}"')
+
+                self._put(chunk)
+                pos = 0
+                while pos < dsize:
+                    buf = stream.read(min(self.window_size, dsize - pos))
+                    if not buf:
+                        raise RuntimeError(f'Chunk "{cname}" truncated! Size = {pos}, expected: {dsize}')
+                    self._put(buf)
+                    pos += len(buf)
+                self._put(None)  # end of chunk data
+
+    def _map_tar(self):
+        # uncompressed SIN-file: chunk data sent directly from mapped file (offset = TarInfo.offset_data)
+        sinfn = self.sinfn
+        self._file = open(self.filename, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+        mv = memoryview(self._mm)
+        imgname = None
+        chunks = [ ]
+        with tarfile.open(fileobj = self._file, mode = 'r:') as tar:
+            for member in tar:
+                if member.type != tarfile.REGTYPE:
+                    continue  # process only regular files
+
+                fn = member.name
+                cname = f'{sinfn}/{fn}'
+                if member.size == 0:
+                    raise RuntimeError(f'Chunk "{cname}" is empty! Size = {member.size}')
+
+                view = mv[member.offset_data:member.offset_data + member.size]
+                if len(view) != member.size:
+                    raise RuntimeError(f'Chunk "{cname}" truncated! Size = {len(view)}, expected: {member.size}')
+
+                if imgname is None:
+                    if not fn.endswith('.cms'):
+                        raise RuntimeError(f'File "{cname}" contain incorrect CMS (ext)')
+                    if view[0:2] != b'\x30\x82':
+                        raise RuntimeError(f'File "{cname}" contain incorrect CMS (magic)')
+                    imgname = osp.splitext(fn)[0]
+                elif osp.splitext(fn)[0] != imgname:
+                    raise RuntimeError(f'File "{sinfn}" contain incorrect filename: "{fn}", expected: "{imgname}"')
+
+                chunks.append( (fn, view) )
+
+        return { 'imgname': imgname, 'chunks': chunks }
+
+    def _read_mapped_chunks(self):
+        self.imgname = self.mapped['imgname']
+        for num, (fn, view) in enumerate(self.mapped['chunks'], -1):
+            dsize = len(view)
+            if dsize >= self.max_download_size:
+                raise RuntimeError(f'Chunk "{self.sinfn}/{fn}" very large! Size = {dsize}, max = {self.max_download_size}')
+
+            if dsize == 0:
+                raise RuntimeError(f'Chunk "{self.sinfn}/{fn}" is empty! Size = {dsize}')
+
+            if num >= 0 and osp.splitext(fn)[0] != self.imgname:
+                raise RuntimeError(f'File "{self.sinfn}" contain incorrect filename: "{fn}", expected: "{self.imgname}"')
+
+            chunk = SinChunk(self, fn, dsize, num)
+            if num == -1:  # CMS
+                chunk.data = bytes(view)
+            else:
+                chunk.view = view
+            self._put(chunk)
+
+    def _read_cached_chunks(self):
+        info = self.info
+        self.imgname = info['imgname']
+        items = [ info['cms'] ] + info['chunks']
+        for item in items:
+            if item['size'] >= self.max_download_size:
+                raise RuntimeError(f'Chunk "{self.sinfn}/{item["name"]}" very large! Size = {item["size"]}, max = {self.max_download_size}')
+
+        # cache entries are filled by separate thread at decompression speed (not at upload speed)
+        filler = _CacheFiller(self.chunk_cache, self.filename, items, self.window_size)
+        self._filler = filler
+        filler.start()
+        try:
+            for num, item in enumerate(items, -1):
+                fn = item['name']
+                dsize = item['size']
+                chunk = SinChunk(self, fn, dsize, num)
+                if num == -1:  # CMS
+                    chunk.data = b''.join(self._iter_member(filler, num + 1, fn, dsize))
+                    self._put(chunk)
+                    continue
+
+                self._put(chunk)
+                for buf in self._iter_member(filler, num + 1, fn, dsize):
+                    self._put(buf)
+                self._put(None)  # end of chunk data
+        finally:
+            if self._tar:
+                self._tar.close()
+                self._tar = None
+
+    def _iter_member(self, filler, idx, fn, dsize):
+        cache = self.chunk_cache
+        key = cache.get_key(self.filename, fn)
+        filler.wait(idx, self.stop_event)
+        mode, file = cache.open(key, create = False)
+        pos = 0
+        if mode:
+            with file:
+                for buf in self._iter_cache_file(file, key, dsize, follow = mode == 'follow'):
+                    pos += len(buf)
+                    yield buf
+            if pos == dsize:
+                return
+            log.debug(f'Chunk cache: "{self.sinfn}/{fn}" stalled at {pos} bytes. Decompressing ...')
+
+        if self._tar is None:
+            self._tar = _TarStream(self.filename, self.window_size)
+        yield from self._tar.iter_member(fn, dsize, pos)
+
+    def _iter_cache_file(self, file, key, dsize, follow):
+        cache = self.chunk_cache
+        pos = 0
+        last_time = time.monotonic()
+        while pos < dsize:
+            buf = file.read(min(self.window_size, dsize - pos))
+            if buf:
+                pos += len(buf)
+                last_time = time.monotonic()
+                yield buf
+                continue
+            if not follow:
+                return  # truncated entry
+            if cache.is_replaced(key, file):
+                return  # writer session was aborted
+            if cache.is_complete(key):
+                follow = False  # writer finished: read rest of file
+                continue
+            if self.stop_event.is_set():
+                raise _ReaderClosed()
+            if time.monotonic() - last_time > cache.stall_timeout:
+                return  # writer session is stuck
+            time.sleep(0.01)
+
+
+class _TarStream():
+    # sequential access to members of tar-file (gzip stream cannot be rewound cheaply)
+    def __init__(self, filename, window_size):
+        self.sinfn = osp.basename(filename)
+        self.window_size = window_size
+        self.tar = tarfile.open(filename)
+        self.members = iter(self.tar)
+
+    def close(self):
+        self.tar.close()
+
+    def iter_member(self, fn, dsize, skip = 0):
+        cname = f'{self.sinfn}/{fn}'
+        for member in self.members:
+            if member.name == fn:
+                break
+        else:
+            raise RuntimeError(f'Chunk "{cname}" not found!')
+
+        if member.size != dsize:
+            raise RuntimeError(f'Chunk "{cname}" changed! Size = {member.size}, expected: {dsize}')
+
+        stream = self.tar.extractfile(member)
+        if skip:
+            stream.seek(skip)
+        pos = skip
+        while pos < dsize:
+            buf = stream.read(min(self.window_size, dsize - pos))
+            if not buf:
+                raise RuntimeError(f'Chunk "{cname}" truncated! Size = {pos}, expected: {dsize}')
+            pos += len(buf)
+            yield buf
+
+
+class _CacheFiller():
+    # decompress chunks of SIN-file into ChunkCache entries, independent of consumer speed
+    def __init__(self, cache, filename, items, window_size):
+        self.cache = cache
+        self.filename = filename
+        self.sinfn = osp.basename(filename)
+        self.items = items
+        self.window_size = window_size
+        self.claimed = 0   # number of items for which entry state is decided
+        self.cond = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target = self._worker, name = f'CacheFiller:{self.sinfn}', daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        # unfinished entry is aborted: reader was closed or upload failed
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def wait(self, idx, stop_event):
+        with self.cond:
+            while self.claimed <= idx:
+                if stop_event.is_set():
+                    raise _ReaderClosed()
+                self.cond.wait(timeout = 0.1)
+
+    def _set_claimed(self, count):
+        with self.cond:
+            self.claimed = count
+            self.cond.notify_all()
+
+    def _worker(self):
+        cache = self.cache
+        tar = None
+        try:
+            for idx, item in enumerate(self.items):
+                if self.stop_event.is_set():
+                    break
+                key = cache.get_key(self.filename, item['name'])
+                mode, file = cache.open(key)
+                if mode == 'fill' and not cache.reserve(key, item['size']):
+                    log.debug(f'Chunk cache: no room for "{self.sinfn}/{item["name"]}" ({item["size"]} bytes)')
+                    cache.abort(key, file)
+                    mode = None
+                self._set_claimed(idx + 1)
+                if mode != 'fill':
+                    if file:
+                        file.close()
+                    continue
+                try:
+                    if tar is None:
+                        tar = _TarStream(self.filename, self.window_size)
+                    for buf in tar.iter_member(item['name'], item['size']):
+                        if self.stop_event.is_set():
+                            raise _ReaderClosed()
+                        file.write(buf)
+                        file.flush()  # make data visible for other sessions
+                except BaseException:
+                    cache.abort(key, file)
+                    raise
+                cache.commit(key, file)
+        except _ReaderClosed:
+            pass
+        except Exception as e:
+            log.debug(f'Chunk cache: cannot fill entries of "{self.sinfn}": {e}')
+        finally:
+            self._set_claimed(len(self.items))
+            if tar:
+                tar.close()
+
+
+def is_gzip_file(filename):
+    with open(filename, 'rb') as file:
+        return file.read(2) == b'\x1F\x8B'
+
+def scan_sin(filename):
+    # parse all tar headers, verify gzip CRC and build manifest of SIN-file
+    sinfn = osp.basename(filename)
+    info = { }
+    info['file'] = sinfn
+    info['size'] = osp.getsize(filename)
+    info['gzip'] = is_gzip_file(filename)
+    info['imgname'] = None
+    info['cms'] = None
+    info['chunks'] = [ ]
+
+    if info['size'] < 512:
+        raise RuntimeError(f'Incorrect SIN-file size: {info["size"]} bytes')
+
+    fileobj = gzip.GzipFile(filename) if info['gzip'] else open(filename, 'rb')
+    try:
+        with tarfile.open(fileobj = fileobj, mode = 'r|') as tar:
+            for member in tar:
+                if member.type != tarfile.REGTYPE:
+                    continue  # process only regular files
+
+                fn = member.name
+                cname = f'{sinfn}/{fn}'
+                if member.size == 0:
+                    raise RuntimeError(f'Chunk "{cname}" is empty! Size = {member.size}')
+
+                stream = tar.extractfile(member)
+                head = stream.read(2)
+                while stream.read(1024*1024):
+                    pass
+
+                item = { 'name': fn, 'size': member.size, 'offset': member.offset_data }
+                if info['cms'] is None:
+                    if not fn.endswith('.cms'):
+                        raise RuntimeError(f'File "{cname}" contain incorrect CMS (ext)')
+                    if head != b'\x30\x82':
+                        raise RuntimeError(f'File "{cname}" contain incorrect CMS (magic)')
+                    info['imgname'] = osp.splitext(fn)[0]
+                    info['cms'] = item
+                    continue
+
+                if osp.splitext(fn)[0] != info['imgname']:
+                    raise RuntimeError(f'File "{sinfn}" contain incorrect filename: "{fn}", expected: "{info["imgname"]}"')
+
+                info['chunks'].append(item)
+
+        if info['gzip']:
+            while fileobj.read(1024*1024):  # gzip CRC verified on EOF
+                pass
+    except (tarfile.TarError, EOFError, OSError, zlib.error) as e:
+        raise RuntimeError(f'File "{sinfn}" is corrupted! Error: {e}')
+    finally:
+        fileobj.close()
+
+    if info['cms'] is None:
+        raise RuntimeError(f'File "{sinfn}" not contain CMS')
+
+    if not info['chunks']:
+        raise RuntimeError(f'File "{sinfn}" not contain image chunks')
+
+    return info
+
+def scan_ta(filename):
+    taulist = ta.load_from_file(filename)
+    if not taulist:
+        raise RuntimeError(f'Incorrect ta-file "{osp.basename(filename)}"')
+
+    info = { }
+    info['file'] = osp.basename(filename)
+    info['size'] = osp.getsize(filename)
+    info['units'] = [ [tau.part, tau.code, len(tau.value)] for tau in taulist ]
+    return info
+
+def scan_file(filename):
+    # worker function for process pool: returns (filename, info, error)
+    try:
+        if filename.endswith('.ta'):
+            return (filename, scan_ta(filename), None)
+        return (filename, scan_sin(filename), None)
+    except Exception as e:
+        return (filename, None, str(e))
+
+def scan_files(filelist, workers = None):
+    manifest = { }
+    errors = { }
+    if not filelist:
+        return manifest, errors
+
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as pool:
+        for fn, info, err in pool.map(scan_file, filelist):
+            if err:
+                errors[fn] = err
+            else:
+                manifest[fn] = info
+
+    return manifest, errors
+
+
+class ManifestCache():
+    version = 1
+
+    def __init__(self, wdir, fname = '.sxf_manifest.json'):
+        self.wdir = wdir
+        self.filename = wdir + osp.sep + fname
+        self.items = { }   # relpath => { 'size', 'mtime', 'data': { kind: value } }
+        self.modified = False
+        self.load()
+
+    def load(self):
+        self.items = { }
+        if not osp.isfile(self.filename):
+            return
+        try:
+            with open(self.filename, 'r', encoding = 'utf-8') as file:
+                cache = json.load(file)
+            if cache.get('version') == self.version:
+                self.items = cache['items']
+        except Exception as e:
+            log.warn(f'Cannot load manifest cache "{self.filename}": {e}')
+
+    def save(self):
+        if not self.modified:
+            return
+        cache = { 'version': self.version, 'items': self.items }
+        tmpfn = self.filename + f'.{os.getpid()}.tmp'
+        try:
+            with open(tmpfn, 'w', encoding = 'utf-8') as file:
+                json.dump(cache, file)
+            os.replace(tmpfn, self.filename)
+            self.modified = False
+        except OSError as e:
+            log.warn(f'Cannot save manifest cache "{self.filename}": {e}')
+
+    def _lookup(self, filename):
+        rel = osp.relpath(filename, self.wdir)
+        st = os.stat(filename)
+        item = self.items.get(rel)
+        if item and (item['size'] != st.st_size or item['mtime'] != st.st_mtime_ns):
+            item = None   # file changed
+        return rel, st, item
+
+    def get(self, filename, kind):
+        try:
+            rel, st, item = self._lookup(filename)
+        except OSError:
+            return None
+        if not item:
+            return None
+        return item['data'].get(kind)
+
+    def set(self, filename, kind, value):
+        rel, st, item = self._lookup(filename)
+        if not item:
+            item = self.items[rel] = { 'size': st.st_size, 'mtime': st.st_mtime_ns, 'data': { } }
+        item['data'][kind] = value
+        self.modified = True
+
+class ChunkCache():
+    # decompressed SIN chunks shared between concurrent sessions (files in temp dir, LRU eviction)
+    def __init__(self, max_size, cache_dir = None):
+        self.max_size = max_size
+        self.cache_dir = cache_dir if cache_dir else osp.join(tempfile.gettempdir(), 'sxf_chunk_cache')
+        self.stall_timeout = 30  # seconds
+        os.makedirs(self.cache_dir, exist_ok = True)
+
+    def get_key(self, filename, member):
+        st = os.stat(filename)
+        key = f'{osp.abspath(filename)}|{st.st_size}|{st.st_mtime_ns}|{member}'
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get_filename(self, key):
+        return osp.join(self.cache_dir, key + '.bin')
+
+    def is_complete(self, key):
+        return osp.exists(self.get_filename(key) + '.ok')
+
+    def is_failed(self, key):
+        return osp.exists(self.get_filename(key) + '.fail')
+
+    def is_replaced(self, key, file):
+        # entry of opened file was removed, recreated or marked as failed by other session
+        try:
+            st = os.stat(self.get_filename(key))
+        except OSError:
+            return True
+        fst = os.fstat(file.fileno())
+        if (st.st_ino, st.st_dev) != (fst.st_ino, fst.st_dev):
+            return True
+        return self.is_failed(key)
+
+    def open(self, key, create = True):
+        # returns (mode, file); mode: 'fill' = write new entry, 'hit' = complete entry, 'follow' = entry filled by other session
+        fn = self.get_filename(key)
+        for attempt in range(2):
+            if create:
+                try:
+                    fd = os.open(fn, os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+                    self._remove_file(fn + '.fail')  # marker of previous aborted entry
+                    return 'fill', os.fdopen(fd, 'wb')
+                except FileExistsError:
+                    pass
+                except OSError as e:
+                    log.debug(f'Chunk cache: cannot create "{fn}": {e}')
+                    return None, None
+            try:
+                file = open(fn, 'rb')
+            except OSError:
+                if not create:
+                    return None, None
+                continue   # entry evicted
+            if self.is_complete(key):
+                self._touch(fn)
+                return 'hit', file
+            if not self.is_failed(key) and time.time() - os.fstat(file.fileno()).st_mtime < self.stall_timeout:
+                return 'follow', file
+            file.close()
+            if not create or not self.remove(key):   # stale entry of aborted session
+                return None, None
+        return None, None
+
+    def reserve(self, key, size):
+        # entry in progress is accounted with final size; returns False if cache cannot hold it
+        try:
+            with open(self.get_filename(key) + '.res', 'w') as file:
+                file.write(str(size))
+        except OSError:
+            return False
+        return self.evict(keep = key) <= self.max_size
+
+    def commit(self, key, file):
+        replaced = self.is_replaced(key, file)
+        file.close()
+        if replaced:
+            return False  # entry was removed as stale by other session
+        fn = self.get_filename(key)
+        try:
+            open(fn + '.ok', 'wb').close()
+        except OSError as e:
+            log.debug(f'Chunk cache: cannot commit entry {key}: {e}')
+            return False
+        self._remove_file(fn + '.res')
+        self.evict(keep = key)
+        return True
+
+    def abort(self, key, file):
+        replaced = self.is_replaced(key, file)
+        file.close()
+        if replaced:
+            return
+        if not self.remove(key):
+            try:
+                open(self.get_filename(key) + '.fail', 'wb').close()  # entry still opened by followers
+            except OSError:
+                pass
+
+    def remove(self, key):
+        fn = self.get_filename(key)
+        try:
+            if osp.exists(fn + '.ok'):
+                os.remove(fn + '.ok')
+            os.remove(fn)
+        except OSError:
+            return False  # still opened by other session
+        self._remove_file(fn + '.fail')
+        self._remove_file(fn + '.res')
+        return True
+
+    def _remove_file(self, fn):
+        try:
+            if osp.exists(fn):
+                os.remove(fn)
+        except OSError:
+            pass
+
+    def _touch(self, fn):
+        try:
+            os.utime(fn + '.ok')
+        except OSError:
+            pass
+
+    def evict(self, keep = None):
+        # removes least recently used complete entries; returns total size of cache (with reservations)
+        entries = [ ]
+        total = 0
+        for fn in os.listdir(self.cache_dir):
+            if not fn.endswith('.bin'):
+                continue
+            key = fn[:-4]
+            fn = osp.join(self.cache_dir, fn)
+            try:
+                size = osp.getsize(fn)
+            except OSError:
+                continue  # entry removed
+            try:
+                atime = os.stat(fn + '.ok').st_mtime
+            except OSError:
+                total += max(size, self._get_reserved(fn))  # entry in progress
+                continue
+            total += size
+            if key != keep:
+                entries.append( (atime, size, key) )
+
+        for atime, size, key in sorted(entries):
+            if total <= self.max_size:
+                break
+            if self.remove(key):
+                total -= size
+        return total
+
+    def _get_reserved(self, fn):
+        try:
+            with open(fn + '.res', 'r') as file:
+                return int(file.read())
+        except (OSError, ValueError):
+            return 0
+
+
+class HotCache():
+    # uncompressed page-aligned container of all SIN chunks of firmware directory
+    version = 1
+    align = mmap.PAGESIZE
+
+    def __init__(self, wdir, fname = '.sxf_hot'):
+        self.wdir = wdir
+        self.filename = wdir + osp.sep + fname + '.bin'
+        self.idxname = wdir + osp.sep + fname + '.json'
+        self.index = None
+        self.file = None
+        self.mm = None
+
+    def load(self):
+        self.index = None
+        if not osp.isfile(self.idxname) or not osp.isfile(self.filename):
+            return False
+        try:
+            with open(self.idxname, 'r', encoding = 'utf-8') as file:
+                index = json.load(file)
+        except Exception as e:
+            log.warn(f'Cannot load hot cache index "{self.idxname}": {e}')
+            return False
+        if index.get('version') != self.version or index.get('size') != osp.getsize(self.filename):
+            log.warn(f'Hot cache "{self.filename}" is outdated')
+            return False
+        try:
+            for relpath, entry in index['files'].items():
+                self.check_entry(relpath, entry, index['size'])
+        except (RuntimeError, KeyError, TypeError) as e:
+            log.warn(f'Hot cache index "{self.idxname}" is incorrect: {e}')
+            return False
+        self.index = index
+        return True
+
+    def check_entry(self, relpath, entry, size):
+        # same checks as for chunks readed from SIN-file
+        sinfn = osp.basename(relpath)
+        cms = entry['cms']
+        imgname = entry['imgname']
+        if not cms or not cms['name'].endswith('.cms') or osp.splitext(cms['name'])[0] != imgname:
+            raise RuntimeError(f'File "{sinfn}" contain incorrect CMS (ext)')
+        if not entry['chunks']:
+            raise RuntimeError(f'File "{sinfn}" not contain image chunks')
+        for item in [ cms ] + entry['chunks']:
+            cname = f'{sinfn}/{item["name"]}'
+            if item['size'] <= 0:
+                raise RuntimeError(f'Chunk "{cname}" is empty! Size = {item["size"]}')
+            if item is not cms and osp.splitext(item['name'])[0] != imgname:
+                raise RuntimeError(f'File "{sinfn}" contain incorrect filename: "{item["name"]}", expected: "{imgname}"')
+            if item['offset'] < 0 or item['offset'] + item['size'] > size:
+                raise RuntimeError(f'Chunk "{cname}" is out of hot cache bounds')
+
+    def close(self):
+        if self.mm:
+            try:
+                self.mm.close()
+            except BufferError:
+                pass  # chunk views still alive
+            self.mm = None
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def get_sin(self, filename):
+        if not self.index:
+            return None
+        entry = self.index['files'].get(osp.relpath(filename, self.wdir))
+        if not entry:
+            return None
+        st = os.stat(filename)
+        if entry['size'] != st.st_size or entry['mtime'] != st.st_mtime_ns:
+            return None   # SIN-file changed after prepare
+        if self.mm is None:
+            self.file = open(self.filename, 'rb')
+            self.mm = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        mv = memoryview(self.mm)
+        chunks = [ (item['name'], mv[item['offset']:item['offset'] + item['size']]) for item in [ entry['cms'] ] + entry['chunks'] ]
+        return { 'imgname': entry['imgname'], 'chunks': chunks }
+
+    def prepare(self, filelist, window_size = 1024*1024):
+        files = { }
+        tmpfn = self.filename + f'.{os.getpid()}.tmp'
+        self.close()
+        try:
+            with open(tmpfn, 'wb') as out:
+                for filename in filelist:
+                    sinfn = osp.basename(filename)
+                    st = os.stat(filename)
+                    entry = { 'size': st.st_size, 'mtime': st.st_mtime_ns, 'imgname': None, 'cms': None, 'chunks': [ ] }
+                    log.info(f'Prepare "{osp.relpath(filename, self.wdir)}" ...')
+                    with tarfile.open(filename) as tar:
+                        for member in tar:
+                            if member.type != tarfile.REGTYPE:
+                                continue  # process only regular files
+                            cname = f'{sinfn}/{member.name}'
+                            if member.size == 0:
+                                raise RuntimeError(f'Chunk "{cname}" is empty! Size = {member.size}')
+                            is_cms = entry['cms'] is None
+                            if is_cms and not member.name.endswith('.cms'):
+                                raise RuntimeError(f'File "{cname}" contain incorrect CMS (ext)')
+                            if not is_cms and osp.splitext(member.name)[0] != entry['imgname']:
+                                raise RuntimeError(f'File "{sinfn}" contain incorrect filename: "{member.name}", expected: "{entry["imgname"]}"')
+                            stream = tar.extractfile(member)
+                            offset = out.tell()
+                            pos = 0
+                            while pos < member.size:
+                                buf = stream.read(min(window_size, member.size - pos))
+                                if not buf:
+                                    raise RuntimeError(f'Chunk "{cname}" truncated!')
+                                if is_cms and pos == 0 and buf[0:2] != b'\x30\x82':
+                                    raise RuntimeError(f'File "{cname}" contain incorrect CMS (magic)')
+                                out.write(buf)
+                                pos += len(buf)
+                            pad = -out.tell() % self.align
+                            if pad:
+                                out.write(b'\x00' * pad)
+                            item = { 'name': member.name, 'offset': offset, 'size': member.size }
+                            if is_cms:
+                                entry['imgname'] = osp.splitext(member.name)[0]
+                                entry['cms'] = item
+                            else:
+                                entry['chunks'].append(item)
+                    if entry['cms'] is None or not entry['chunks']:
+                        raise RuntimeError(f'File "{sinfn}" not contain image chunks')
+                    files[osp.relpath(filename, self.wdir)] = entry
+                size = out.tell()
+
+            os.replace(tmpfn, self.filename)
+        finally:
+            if osp.exists(tmpfn):
+                os.remove(tmpfn)
+
+        index = { 'version': self.version, 'align': self.align, 'size': size, 'files': files }
+        with open(self.idxname + '.tmp', 'w', encoding = 'utf-8') as file:
+            json.dump(index, file, indent = 1)
+        os.replace(self.idxname + '.tmp', self.idxname)
+        self.index = index
+        log.info(f'Hot cache "{self.filename}" prepared: {len(files)} files, {size} bytes')
+        return index
@@ -1,6 +1,6 @@
 import os
 import sys
-import array
+import struct
 
 class TAUnit():
     def __init__(self, part, code, name = '', doc = ''):
@@ -171,122 +171,202 @@ for part, pv in enumerate(_tau):
                 unit[name].doc = info[1]
                 punit[part][code].doc = info[1]
 
- 
-def load_from_file(fn):
-    global punit
-    with open(fn, 'r', encoding = 'latin-1') as file:
-        lines = file.readlines()
-    
-    tau = TAUnit(None, None)
-    tau._size = -1
-    tau._ulist = [ ]
-    
-    def add_unit(tau):
-        global punit
-        if tau._size >= 0:
-            if tau.part is None or tau.code is None:
-                raise ValueError(f'Incorrect ta-file "{fn}". Part = {tau.part}, Code = {tau.code}')
-
-            if tau._pos < 0:
-                raise ValueError(f'Incorrect ta-file "{fn}". Pos = {tau._pos}')
-
-            if tau._pos != tau._size:
-                raise ValueError(f'Incorrect ta-file "{fn}". Pos = {tau._pos}, Size = {tau._size}')
-
-            unit = TAUnit(tau.part, tau.code)
-            if tau._size > 0:
-                unit.value = bytes(tau._data)
-            else:
-                unit.value = b''
-                
-            if tau.code in punit[tau.part]:
-                unit.name = punit[tau.part][tau.code].name
-                
-            tau._ulist.append(unit)
-
-        tau.code = None
-        tau._size = -1
-        tau._data = None
-        tau._pos = -1
-
-    add_unit(tau)
-    
-    for line in lines:
+
+TA_BIN_MAGIC = b'SXTA'
+TA_BIN_VERSION = 1
+
+_bin_header = struct.Struct('<4sHHI')   # magic, version, reserved, number of units
+_bin_entry = struct.Struct('<BxxxIII')  # part, code, offset, size
+
+
+def _make_unit(fn, part, code, size, hexdata):
+    hexstr = ' '.join(' '.join(hexdata).split())
+    try:
+        value = bytes.fromhex(hexstr)
+    except ValueError:
+        value = None
+    if value is None or (hexstr and len(hexstr) != len(value) * 3 - 1):
+        # each token must be exactly one byte (fromhex also accepts tokens like "0102")
+        raise ValueError(f'Incorrect ta-file "{fn}". Unit {part}:{code}: incorrect data')
+    if len(value) != size:
+        raise ValueError(f'Incorrect ta-file "{fn}". Unit {part}:{code}: Size = {len(value)}, expected: {size}')
+    unit = TAUnit(part, code)
+    unit.value = value
+    if code in punit[part]:
+        unit.name = punit[part][code].name
+    return unit
+
+def iter_units(file, fn = ''):
+    # streaming parser of text TA-file: data of each unit is decoded with single bytes.fromhex
+    part = None
+    code = None
+    size = -1
+    hexdata = [ ]
+    for line in file:
         line = line.rstrip()
         if not line or line.startswith('//'):
             continue
 
-        if line.strip() == '':
-            continue
-
         if line == '01' or line == '02':
-            add_unit(tau)
-            tau.part = int(line, 16)
+            if code is not None:
+                yield _make_unit(fn, part, code, size, hexdata)
+                code = None
+            part = int(line, 16)
             continue
 
-        if tau.part is None:
+        if part is None:
             raise ValueError(f'Incorrect ta-file "{fn}". PartNum: "{line}"')
-        
-        line = line.replace('\t', ' ')
-        
-        if not line.startswith(' '):
-            add_unit(tau)
-        
-        if tau.code is None:
-            if line.startswith(' '):
+
+        if line[0] == ' ' or line[0] == '\t':
+            if code is None:
                 raise ValueError(f'Incorrect ta-file "{fn}". Unit: "{line}"')
-            
-            line = line.strip()
-            line = line.replace('   ', ' ')
-            line = line.replace('  ', ' ')
-            
-            vlst = line.split(' ')
-            if len(vlst) < 2:
-                raise ValueError(f'Incorrect ta-file "{fn}". UnitNum: "{line}"')
-                
-            ucode = vlst[0]
-            if len(ucode) != 4 and len(ucode) != 8:
-                raise ValueError(f'Incorrect ta-file "{fn}". UnitNum: "{line}"')
-
-            tau.code = int(ucode, 16)
-
-            usize = vlst[1]
-            if len(usize) != 4 and len(usize) != 8:
-                raise ValueError(f'Incorrect ta-file "{fn}". UnitNum: "{line}"')
-
-            tau._size = int(usize, 16)
-            
-            if tau._size == 0:
-                tau._pos = 0
-                add_unit(tau)
-                continue
-
-            tau._data = array.array('B', b'\x00' * tau._size)
-            line = '  ' + ' '.join( vlst[2:] )
-            tau._pos = 0
-
-        if tau._size < 0:
-            raise ValueError(f'Incorrect ta-file "{fn}". Negative tau_size')
-
-        if not line.startswith(' '):
-            raise ValueError(f'Incorrect ta-file "{fn}". Data: "{line}"')
-
-        line = line.strip()
-        if len(line) < 2:
-            raise ValueError(f'Incorrect ta-file "{fn}". Data: "{line}"')
-            
-        vlst = line.split(' ')
-        for v in vlst:
-            if len(v) != 2:
-                raise ValueError(f'Incorrect ta-file "{fn}". Data: "{line}"')
-            
-            if tau._pos >= tau._size:
-                raise ValueError(f'Incorrect ta-file "{fn}". Pos = {tau._pos} , Size = {tau._size}')
-            
-            tau._data[tau._pos] = int(v, 16)
-            tau._pos += 1
-        pass
-                
-    add_unit(tau)
-    return tau._ulist
-    
+            hexdata.append(line)
+            continue
+
+        if code is not None:
+            yield _make_unit(fn, part, code, size, hexdata)
+
+        vlst = line.split(None, 2)
+        if len(vlst) < 2 or len(vlst[0]) not in [ 4, 8 ] or len(vlst[1]) not in [ 4, 8 ]:
+            raise ValueError(f'Incorrect ta-file "{fn}". UnitNum: "{line}"')
+
+        code = int(vlst[0], 16)
+        size = int(vlst[1], 16)
+        hexdata = vlst[2:]
+
+    if code is not None:
+        yield _make_unit(fn, part, code, size, hexdata)
+
+def is_bin_file(fn):
+    with open(fn, 'rb') as file:
+        return file.read(len(TA_BIN_MAGIC)) == TA_BIN_MAGIC
+
+def load_from_file(fn):
+    if is_bin_file(fn):
+        return load_from_bin(fn)
+    with open(fn, 'r', encoding = 'latin-1') as file:
+        return list(iter_units(file, fn))
+
+def save_to_file(fn, ulist, width = 16):
+    with open(fn, 'w', encoding = 'latin-1', newline = '\n') as file:
+        part = None
+        for unit in ulist:
+            if unit.part != part:
+                part = unit.part
+                file.write(f'{part:02X}\n')
+            value = unit.value or b''
+            size = len(value)
+            line = f'{unit.code:08X} {size:04X}' if size <= 0xFFFF else f'{unit.code:08X} {size:08X}'
+            if size:
+                line += ' ' + value[:width].hex(' ').upper()
+            file.write(line + '\n')
+            for pos in range(width, size, width):
+                file.write(' ' + value[pos:pos+width].hex(' ').upper() + '\n')
+
+def save_to_bin(fn, ulist):
+    # header, index of units (part, code, offset, size), data of units
+    offset = _bin_header.size + _bin_entry.size * len(ulist)
+    index = [ ]
+    for unit in ulist:
+        size = len(unit.value or b'')
+        index.append(_bin_entry.pack(unit.part, unit.code, offset, size))
+        offset += size
+    with open(fn, 'wb') as file:
+        file.write(_bin_header.pack(TA_BIN_MAGIC, TA_BIN_VERSION, 0, len(ulist)))
+        file.write(b''.join(index))
+        for unit in ulist:
+            if unit.value:
+                file.write(unit.value)
+
+def read_bin_index(file, fn = ''):
+    hdr = file.read(_bin_header.size)
+    if len(hdr) != _bin_header.size:
+        raise ValueError(f'Incorrect binary ta-file "{fn}". Header too short')
+    magic, version, _, count = _bin_header.unpack(hdr)
+    if magic != TA_BIN_MAGIC or version != TA_BIN_VERSION:
+        raise ValueError(f'Incorrect binary ta-file "{fn}". Magic = {magic}, Version = {version}')
+    data = file.read(_bin_entry.size * count)
+    if len(data) != _bin_entry.size * count:
+        raise ValueError(f'Incorrect binary ta-file "{fn}". Index too short')
+    return list(_bin_entry.iter_unpack(data))
+
+def load_from_bin(fn, units = None):
+    # units: list of (part, code) for loading selected units only
+    ulist = [ ]
+    with open(fn, 'rb') as file:
+        index = read_bin_index(file, fn)
+        if units is not None:
+            units = set([ tuple(addr) for addr in units ])
+            index = [ entry for entry in index if (entry[0], entry[1]) in units ]
+            data = None
+        else:
+            data = file.read()
+            base = _bin_header.size + _bin_entry.size * len(index)
+        for part, code, offset, size in index:
+            if data is None:
+                file.seek(offset)
+                value = file.read(size)
+            else:
+                value = data[offset - base:offset - base + size]
+            if len(value) != size:
+                raise ValueError(f'Incorrect binary ta-file "{fn}". Unit {part}:{code}: data truncated')
+            unit = TAUnit(part, code)
+            unit.value = value
+            if code in punit[part]:
+                unit.name = punit[part][code].name
+            ulist.append(unit)
+    return ulist
+
+def parse_dump(data, part, fn = ''):
+    # response of "Read-all-TA:<part>": sequence of [code: u32be][size: u32be][data]
+    ulist = [ ]
+    mv = memoryview(data)
+    pos = 0
+    while pos < len(mv):
+        if len(mv) - pos < 8:
+            raise ValueError(f'Incorrect TA dump "{fn}". Header of unit truncated at pos = {pos}')
+        code = int.from_bytes(mv[pos:pos+4], byteorder = 'big')
+        size = int.from_bytes(mv[pos+4:pos+8], byteorder = 'big')
+        pos += 8
+        if pos + size > len(mv):
+            raise ValueError(f'Incorrect TA dump "{fn}". Unit {part}:{code}: data truncated')
+        unit = TAUnit(part, code)
+        unit.value = bytes(mv[pos:pos+size])
+        if code in punit[part]:
+            unit.name = punit[part][code].name
+        ulist.append(unit)
+        pos += size
+    return ulist
+
+def convert(src, dst, fmt = None):
+    # fmt: 'bin' or 'text' (default: opposite to format of src)
+    ulist = load_from_file(src)
+    if fmt is None:
+        fmt = 'text' if is_bin_file(src) else 'bin'
+    if fmt == 'bin':
+        save_to_bin(dst, ulist)
+    elif fmt == 'text':
+        save_to_file(dst, ulist)
+    else:
+        raise ValueError(f'Incorrect TA format "{fmt}"')
+    return ulist
+
+
+if __name__ == '__main__':
+    import optparse
+    parser = optparse.OptionParser("usage: %prog [options] input output", add_help_option = False)
+    parser.add_option("-f", "--format", dest = "format", default = None, type = "string")  # bin or text
+    parser.add_option("-l", "--list", dest = "list", action="store_true", default = False)
+    (opt, args) = parser.parse_args()
+
+    if opt.list and len(args) == 1:
+        for unit in load_from_file(args[0]):
+            print(f'{unit.part}:{unit.code:<6} size: {len(unit.value):<8} {unit.name}')
+        exit(0)
+
+    if len(args) != 2:
+        parser.print_usage()
+        exit(1)
+
+    ulist = convert(args[0], args[1], opt.format)
+    print(f'Converted {len(ulist)} units: "{args[0]}" => "{args[1]}"')
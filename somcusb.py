@@ -1,5 +1,7 @@
 import os
 import sys
+import time
+import json
 import enum
 import queue
 import array
@@ -43,6 +45,8 @@ import logging
 from logcfg import log
 
 
+tune_filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sxf_tune.json')
+
 class SXError(IOError):
     def __init__(self, msg, errno = 0):
         IOError.__init__(self, errno, msg)
@@ -59,6 +63,144 @@ class SomcUsbResponse():
         else:
             return f'<{len(self.data)},{self.retcode},"{self.errtext}">'
 
+class UsbStats():
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.start_time = time.monotonic()
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.write_calls = 0
+        self.read_calls = 0
+        self.write_time = 0.0   # time spent on the wire (host -> device)
+        self.read_time = 0.0    # time spent waiting for device responses
+        self.commands = { }     # name => { count, time, min, max }
+        self.uploads = { 'count': 0, 'bytes': 0, 'time': 0.0, 'cmd_time': 0.0, 'data_time': 0.0, 'ack_time': 0.0 }
+
+    def add_write(self, size, dt):
+        self.write_calls += 1
+        self.bytes_written += size
+        self.write_time += dt
+
+    def add_read(self, size, dt):
+        self.read_calls += 1
+        self.bytes_read += size
+        self.read_time += dt
+
+    def add_command(self, msg, dt):
+        if isinstance(msg, bytes):
+            msg = msg.decode('latin-1')
+        name = msg.split(':')[0]
+        cmd = self.commands.get(name)
+        if cmd is None:
+            cmd = self.commands[name] = { 'count': 0, 'time': 0.0, 'min': dt, 'max': dt }
+        cmd['count'] += 1
+        cmd['time'] += dt
+        cmd['min'] = min(cmd['min'], dt)
+        cmd['max'] = max(cmd['max'], dt)
+
+    def add_upload(self, size, cmd_time, data_time, ack_time):
+        up = self.uploads
+        up['count'] += 1
+        up['bytes'] += size
+        up['cmd_time'] += cmd_time
+        up['data_time'] += data_time
+        up['ack_time'] += ack_time
+        up['time'] += cmd_time + data_time + ack_time
+
+    def as_dict(self):
+        res = { }
+        res['elapsed'] = time.monotonic() - self.start_time
+        for name in [ 'bytes_written', 'bytes_read', 'write_calls', 'read_calls', 'write_time', 'read_time' ]:
+            res[name] = getattr(self, name)
+        res['commands'] = { }
+        for name, cmd in self.commands.items():
+            res['commands'][name] = dict(cmd, avg = cmd['time'] / cmd['count'])
+        up = res['uploads'] = dict(self.uploads)
+        up['mbps'] = up['bytes'] / up['time'] / 1e6 if up['time'] > 0 else None
+        up['data_mbps'] = up['bytes'] / up['data_time'] / 1e6 if up['data_time'] > 0 else None
+        return res
+
+    def dump(self, filename):
+        with open(filename, 'w', encoding = 'utf-8') as file:
+            json.dump(self.as_dict(), file, indent = 4)
+
+# commands which can change TA units on device side (TA cache is dropped)
+ta_cache_reset_cmds = [ 'flash', 'erase', 'Repartition', 'set_active', 'Sync', 'powerdown', 'reboot', 'reboot-bootloader', 'continue' ]
+
+# getvar variables which can change within session (dropped after commands listed in getvar_reset_cmds)
+volatile_vars = [ 'Battery', 'current-slot', 'Security-state', 'Stored-security-state', 'Rooting-status',
+                  'Keystore-counter', 'Keystore-xcs', 'Frp-partition', 'has-slot' ]
+
+getvar_reset_cmds = [ 'set_active', 'Write-TA', 'Sync', 'Repartition', 'powerdown', 'reboot', 'reboot-bootloader', 'continue' ]
+
+# attr, command, data type, lazy
+device_vars = [
+    ( 'max_download_size',     'getvar:max-download-size',     'int',   False ),
+    ( 'sector_size',           'getvar:Sector-size',           'int',   False ),
+    ( 'product',               'getvar:product',               'str',   False ),
+    ( 'version',               'getvar:version',               'str',   False ),
+    ( 'blver',                 'getvar:version-bootloader',    'str',   False ),
+    ( 'bbver',                 'getvar:version-baseband',      'str',   False ),
+    ( 'serialno',              'getvar:serialno',              'str',   False ),
+    ( 'secure',                'getvar:secure',                'str',   False ),
+    ( 'loader_ver',            'getvar:Loader-version',        'str',   False ),
+    ( 'phone_id',              'getvar:Phone-id',              'str',   False ),
+    ( 'device_id',             'getvar:Device-id',             'str',   False ),
+    ( 'platform_id',           'getvar:Platform-id',           'str',   False ),
+    ( 'rooting_status',        'getvar:Rooting-status',        'str',   False ),  # RPMB
+    ( 'ufs_info',              'getvar:Ufs-info',              'str',   False ),
+    ( 'emmc_info',             'getvar:Emmc-info',             'str',   False ),
+    ( 'def_security',          'getvar:Default-security',      'str',   False ),
+    ( 'keystore_counter',      'getvar:Keystore-counter',      'int',   False ),  # RPMB
+    ( 'security_state',        'getvar:Security-state',        'str',   False ),  # RPMB
+    ( 's1_root',               'getvar:S1-root',               'str',   False ),
+    ( 'sake_root',             'getvar:Sake-root',             'str',   False ),  # RPMB
+    ( 'root_key_hash',         'Get-root-key-hash',            'bytes', False ),  # PLF_ROOT_HASH
+    ( 'slot_count',            'getvar:slot-count',            'int',   False ),
+    ( 'current_slot',          'getvar:current-slot',          'str',   False ),
+    ( 'battery_level',         'getvar:Battery',               'int',   False ),
+    ( 'stored_security_state', 'getvar:Stored-security-state', 'str',   True  ),  # RPMB
+    ( 'keystore_xcs',          'getvar:Keystore-xcs',          'str',   True  ),  # RPMB
+    ( 'frp_partition',         'getvar:Frp-partition',         'str',   True  ),
+    ( 'x_conf',                'getvar:X-conf',                'str',   True  ),
+    ( 'soc_unique_id',         'getvar:Soc-unique-id',         'str',   True  ),
+]
+
+# vars without which device cannot be flashed (DeviceInfo.fetch raises if value cannot be read)
+required_vars = [ 'max_download_size' ]
+
+class DeviceInfo():
+    def __init__(self, sud, varlist = device_vars):
+        self._sud = sud
+        self._vars = { attr: (cmd, dt, lazy) for attr, cmd, dt, lazy in varlist }
+        self._values = { }
+
+    def fetch(self, names = None):
+        if names is None:
+            names = [ attr for attr, (cmd, dt, lazy) in self._vars.items() if not lazy ]
+        names = [ attr for attr in names if attr not in self._values ]
+        cmdlist = [ self._vars[attr][:2] for attr in names ]
+        for attr, value in zip(names, self._sud.command_burst(cmdlist)):
+            if value is None and attr in required_vars:
+                raise RuntimeError(f'Cannot read required device var "{self._vars[attr][0]}"')
+            self._values[attr] = value
+        return self
+
+    def fetch_all(self):
+        return self.fetch(list(self._vars.keys()))
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in self._vars:
+            raise AttributeError(name)
+        if name not in self._values:
+            self.fetch([ name ])  # lazy fetch
+        return self._values[name]
+
+    def as_dict(self):
+        return dict(self._values)
+
 class SomcUsbDevice():
     def __init__(self, loglevel = logging.CRITICAL):
         self.dev = None
@@ -72,7 +214,23 @@ class SomcUsbDevice():
         self.read_timeout = 500    # 500 ms
         self.write_timeout = 2000  # 2 seconds
         self.write_chunk_size = 0  # 0 = wMaxPacketSize
+        self.read_chunk_size = 1024*1024  # max size of bulk request for DATA payload (0 = wMaxPacketSize)
+        self.upload_window_size = 1024*1024  # 1 MiB
+        self.async_write_size = 256*1024     # payloads of this size or larger are sent with async transfers (0 = disabled)
+        self.async_transfer_size = 64*1024
+        self.async_transfer_num = 4
         self.max_download_size = 0
+        self.dev_path = None    # select device by USB path (bus-port.port...)
+        self.dev_serial = None  # select device by serial number
+        self.stats = UsbStats()
+        self.cmd_pipeline_depth = 8  # max number of commands sent ahead of responses (1 = disabled; reset to 1 if loader fails on pipelined commands)
+        self.cmd_pipeline_probed = False  # pipelining checked for current connection
+        self.usb_backend = None  # custom pyusb backend (e.g. sxemu)
+        self.use_ta_cache = False  # cache values of TA units within session
+        self.ta_cache = { }        # (part, code) => value
+        self.ta_cache_parts = set()  # TA partitions loaded entirely with Read-all-TA
+        self.use_getvar_cache = True
+        self.getvar_cache = { }    # 'getvar:<name>' => response
 
     def __del__(self):
         if self.dev:
@@ -103,6 +261,10 @@ class SomcUsbDevice():
         dlst = [ ]
         dname = os.path.dirname(os.path.abspath(__file__))
         find_library = None
+        if self.usb_backend:
+            devlist = usb.core.find(find_all = True, idVendor = vid, idProduct = pid, backend = self.usb_backend)
+            return list(devlist)
+
         if sys.platform == 'win32':
             if ctypes.sizeof(ctypes.c_void_p) == 4:
                 libpath = dname + os.path.sep + "libusb1_32.dll"
@@ -123,6 +285,30 @@ class SomcUsbDevice():
         
         return dlst
 
+    def list_devices(self):
+        devlist = self.get_usb_devlist(0x0FCE, 0xB00B)  # SOMC 2017 XFL
+        return [ { 'path': get_usb_dev_path(dev), 'serial': get_usb_dev_serial(dev) } for dev in devlist ]
+
+    def select_device(self, devlist):
+        if self.dev_path:
+            devlist = [ dev for dev in devlist if get_usb_dev_path(dev) == self.dev_path ]
+            if not devlist:
+                raise RuntimeError(f'SOMC usb device with path "{self.dev_path}" not found!')
+
+        if self.dev_serial:
+            devlist = [ dev for dev in devlist if get_usb_dev_serial(dev) == self.dev_serial ]
+            if not devlist:
+                raise RuntimeError(f'SOMC usb device with serial "{self.dev_serial}" not found!')
+
+        if len(devlist) > 1:
+            paths = ', '.join([ get_usb_dev_path(dev) for dev in devlist ])
+            raise RuntimeError(f"Founded {len(devlist)} SOMC usb devices! Please select device by path or serial: {paths}")
+
+        dev = devlist[0]
+        self.dev_path = get_usb_dev_path(dev)
+        log.info(f'Selected USB device: {self.dev_path}')
+        return dev
+
     def print_dev_struct(self, dev = None):
         dev = self.dev if dev is None else dev
         #log.debug(f"VID: 0x{dev.idVendor:04X}  PID: 0x{dev.idProduct:04X}  DeviceClass: 0x{dev.bDeviceClass:02X}")
@@ -138,12 +324,12 @@ class SomcUsbDevice():
         if not devlist:
             raise RuntimeError("SOMC usb device not found!")
 
-        if len(devlist) > 1:
-            raise RuntimeError(f"Founded {len(devlist)} SOMC usb devices!")
-
-        dev = devlist[0]
+        dev = self.select_device(devlist)
         del devlist
         self.dev = dev
+        self.clear_ta_cache()
+        self.clear_getvar_cache()
+        self.cmd_pipeline_probed = False
         
         self.print_dev_struct()        
 
@@ -200,7 +386,7 @@ class SomcUsbDevice():
 
     def check_usb_driver(self, force = 'ggsomc'):
         dev = self.dev
-        if sys.platform != 'win32':
+        if sys.platform != 'win32' or self.usb_backend:
             return 0
 
         import ggsomc
@@ -239,9 +425,27 @@ class SomcUsbDevice():
         if not usb_backend:
             raise RuntimeError(f'Cannot switch to ggsomc backend')
 
-        dev = usb.core.find(idVendor = self.dev.idVendor, idProduct = self.dev.idProduct, backend = usb_backend)
-        if not dev:
+        # device interface path: \\?\usb#vid_XXXX&pid_XXXX#<instance id>#{guid}
+        keys = [ ]
+        inst_id = ggsomc.get_usb_instance_id(xdev)
+        if inst_id:
+            keys.append(inst_id)
+        serial = self.dev_serial or get_usb_dev_serial(xdev)
+        if serial:
+            keys.append(serial)
+        keys = [ b'#' + key.lower().encode() + b'#' for key in keys ]
+
+        devlist = list(usb.core.find(find_all = True, idVendor = self.dev.idVendor, idProduct = self.dev.idProduct, backend = usb_backend))
+        if not devlist:
             raise RuntimeError("USB device not connected (ggsomc)")
+
+        match = [ d for d in devlist if any([ key in d._ctx.dev.path.lower() for key in keys ]) ]
+        if len(match) == 1:
+            dev = match[0]
+        elif not match and len(devlist) == 1:
+            dev = devlist[0]
+        else:
+            raise RuntimeError(f'Cannot identify selected device among {len(devlist)} ggsomc devices (instance: {inst_id}, serial: {serial})')
         
         log.debug(f'ggdev: {type(dev)}')
         self.dev = dev
@@ -265,7 +469,7 @@ class SomcUsbDevice():
         self.dev.default_timeout = 500
         max_download_size = None
         try:
-            max_download_size = self.getvar('max-download-size')
+            max_download_size = self.getvar('max-download-size', cache = False)
         #except usb.core.USBTimeoutError:
         #    raise
         except Exception:
@@ -322,6 +526,104 @@ class SomcUsbDevice():
         self.write_chunk_size = size
         log.info(f'Set write chunk size: {size} bytes  (EP.OUT.wMaxPacketSize = {ep.wMaxPacketSize})')
 
+    def get_tune_key(self, product):
+        # host port of device: bus (libusb), else port path or serial number (bus is None with ggsomc)
+        dev = self.dev
+        backend = type(dev._ctx.backend).__name__
+        if dev.bus is not None:
+            port = f'bus{dev.bus}'
+        elif dev.port_numbers:
+            port = 'port' + '.'.join([ str(pn) for pn in dev.port_numbers ])
+        else:
+            serial = get_usb_dev_serial(dev)
+            port = f'sn{serial}' if serial else f'port{dev.port_number}'
+        return f'{product}|{platform.node()}:{port}|{backend}'
+
+    def tune_write_chunk_size(self, product, force = False, probe_size = 8*1024*1024):
+        # probe write chunk sizes with download of scratch data and select the fastest
+        key = self.get_tune_key(product)
+        tune = { }
+        try:
+            with open(tune_filename, 'r', encoding = 'utf-8') as file:
+                tune = json.load(file)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log.warn(f'Cannot load tune file "{tune_filename}": {e}')
+
+        if not force and key in tune:
+            log.info(f'Write chunk size for "{key}" loaded from tune file ({tune[key]["mbps"]:.1f} MB/s)')
+            self.set_write_chunk_size(tune[key]['wcs'])
+            return self.write_chunk_size
+
+        pktsize = self.epout.wMaxPacketSize
+        candidates = [ pktsize ] + [ size - size % pktsize for size in [ 16*1024, 64*1024, 256*1024, 1024*1024 ] ]
+        probe_size = min(probe_size, self.max_download_size - 1)
+        data = bytes(probe_size)
+        best = None
+        for size in candidates:
+            try:
+                mbps = probe_size / self.probe_write(data, size) / 1e6
+            except (usb.core.USBError, RuntimeError) as e:
+                log.warn(f'Tune: write chunk size = {size} failed! Error: {e}')
+                continue
+            log.info(f'Tune: write chunk size = {size:>7} : {mbps:.1f} MB/s')
+            if best is None or mbps > best[1]:
+                best = ( size, mbps )
+        
+        self.upload(b'')  # clear download buffer
+        if best is None:
+            raise RuntimeError(f'Cannot tune write chunk size!')
+
+        self.set_write_chunk_size(best[0])
+        tune[key] = { 'wcs': best[0], 'mbps': best[1], 'date': datetime.now().isoformat(timespec = 'seconds') }
+        tmpfn = tune_filename + f'.{os.getpid()}.tmp'
+        try:
+            with open(tmpfn, 'w', encoding = 'utf-8') as file:
+                json.dump(tune, file, indent = 4)
+            os.replace(tmpfn, tune_filename)
+        except OSError as e:
+            log.warn(f'Cannot save tune file "{tune_filename}": {e}')
+        return best[0]
+
+    def probe_write(self, data, size):
+        # timed download of data with sync writes of given size (async transfers would override chunk size)
+        epaddr = self.epout.bEndpointAddress
+        dsize = len(data)
+        self.write(f'download:{dsize:08X}')
+        resp = self.read(onepkt = True)
+        if resp.retcode != 0 or resp.errtext != 'DATA_SIZE':
+            raise RuntimeError(f'Error on download command: {str(self.lastresp)}')
+
+        mv = memoryview(data)
+        pos = 0
+        t0 = time.perf_counter()
+        try:
+            while pos < dsize:
+                pos += self.dev.write(epaddr, mv[pos:pos+size], timeout = self.write_timeout)
+        except usb.core.USBError:
+            self.abort_download(mv, pos)
+            raise
+        resp = self.read(onepkt = True)
+        elapsed = time.perf_counter() - t0
+        if resp.retcode != 0 or resp.errtext != '':
+            raise RuntimeError(f'Error on download command: {str(self.lastresp)}')
+        return elapsed
+
+    def abort_download(self, data, pos):
+        # bootloader have no abort command: complete pending data phase with packet sized writes
+        epaddr = self.epout.bEndpointAddress
+        pktsize = self.epout.wMaxPacketSize
+        try:
+            while pos < len(data):
+                pos += self.dev.write(epaddr, data[pos:pos+pktsize], timeout = self.write_timeout)
+            self.read(onepkt = True)
+        except Exception as e:
+            log.debug(f'Cannot complete pending download: {e}')
+            self.init_streams()
+            return
+        self.read_all_packets(self.epin, 100)
+
     def raw_write(self, data, timeout = None):
         if timeout is None:
             timeout = self.write_timeout
@@ -329,17 +631,43 @@ class SomcUsbDevice():
         ep = self.epout
         epaddr = ep.bEndpointAddress
         pktsize = self.write_chunk_size if self.write_chunk_size > 0 else ep.wMaxPacketSize
-        if len(data) <= pktsize:
-            size = self.dev.write(epaddr, data, timeout = timeout)
-        else:
-            size = 0
-            while size < len(data):
-                bsz = pktsize if size + pktsize <= len(data) else len(data) - size 
-                size += self.dev.write(epaddr, data[size:size+bsz], timeout = timeout)
+        size = None
+        t0 = time.perf_counter()
+        if self.async_write_size and len(data) >= self.async_write_size:
+            size = self.raw_write_async(data, timeout)  # None = async mode not supported
         
+        if size is None:
+            if len(data) <= pktsize:
+                size = self.dev.write(epaddr, data, timeout = timeout)
+            else:
+                mv = memoryview(data)  # zero-copy slicing
+                size = 0
+                while size < len(data):
+                    bsz = pktsize if size + pktsize <= len(data) else len(data) - size
+                    size += self.dev.write(epaddr, mv[size:size+bsz], timeout = timeout)
+        
+        self.stats.add_write(size, time.perf_counter() - t0)
         if size != len(data):
             raise RuntimeError(f'USB write error: size = {size}, expected: {len(data)}')
 
+    def raw_write_async(self, data, timeout):
+        write_async = getattr(self.dev, 'write_async', None)
+        if not write_async:
+            self.async_write_size = 0
+            return None
+        
+        ep = self.epout
+        tsize = self.async_transfer_size
+        if self.write_chunk_size > tsize:
+            tsize = self.write_chunk_size
+        tsize -= tsize % ep.wMaxPacketSize
+        try:
+            return write_async(ep.bEndpointAddress, data, timeout, tsize, self.async_transfer_num)
+        except NotImplementedError:
+            log.debug(f'Async USB write not supported by backend. Using sync mode.')
+            self.async_write_size = 0
+            return None
+
     def write(self, data):
         if isinstance(data, str):
             data = data.encode()
@@ -350,26 +678,36 @@ class SomcUsbDevice():
         ep = self.epin
         epaddr = ep.bEndpointAddress
         pktsize = ep.wMaxPacketSize
-        data = array.array('B', [ ])
-        while True:
-            if size > 0 and pktsize > size - len(data):
-                pktsize = size - len(data)
-            plen = len(data)
-            try:                
-                data += self.dev.read(epaddr, pktsize, timeout)
+        t0 = time.perf_counter()
+        if size <= 0:
+            try:
+                data = self.dev.read(epaddr, pktsize, timeout)
+            except usb.core.USBTimeoutError:
+                data = None
+            data = data.tobytes() if data else b''
+            self.stats.add_read(len(data), time.perf_counter() - t0)
+            return data
+
+        # size is known: read inplace into preallocated buffer with large bulk requests (returns bytearray)
+        maxsize = max(self.read_chunk_size - self.read_chunk_size % pktsize, pktsize)
+        data = bytearray(size)
+        mv = memoryview(data)
+        pos = 0
+        while pos < size:
+            bsz = min(size - pos, maxsize)
+            try:
+                rsz = self.dev.read(epaddr, mv[pos:pos+bsz], timeout)
             except usb.core.USBTimeoutError:
                 break
-            if len(data) == plen:
+            if rsz == 0:
                 break  # readed 0 bytes ==> EOF
-            if size == 0:
-                break
-            if size > 0 and len(data) >= size:
-                break
+            pos += rsz
         
-        if size > 0 and size != len(data):
-            raise RuntimeError(f'Error on read stream from USB device! Read size = {len(data)} , expected: {size}')
+        self.stats.add_read(pos, time.perf_counter() - t0)
+        if pos != size:
+            raise RuntimeError(f'Error on read stream from USB device! Read size = {pos} , expected: {size}')
 
-        return data.tobytes()
+        return data
 
     def read(self, onepkt = False, timeout = None):        
         self.lastresp = SomcUsbResponse(None, -1000)
@@ -406,7 +744,10 @@ class SomcUsbDevice():
 
             size = int(header[4:].decode('latin-1'), 16)
             if size > 0:
-                data += self.raw_read(size, timeout)
+                if data:
+                    data += self.raw_read(size, timeout)
+                else:
+                    data = self.raw_read(size, timeout)
             
             header = self.raw_read(0, timeout)
             if len(header) < 4:
@@ -417,6 +758,7 @@ class SomcUsbDevice():
                 footer = header[4:]
                 break  
             
+        data = bytes(data)  # raw_read returns mutable buffer: responses always carry bytes
         if ht == b'FAIL':
             self.lastresp = SomcUsbResponse(data, -2, footer.decode('latin-1'))
             return self.lastresp
@@ -425,7 +767,97 @@ class SomcUsbDevice():
         return self.lastresp
         
     def command(self, msg, dt = 'bytes'):
+        self.check_caches(msg)
+        t0 = time.perf_counter()
         self.write(msg)
+        resp = self.read()
+        self.stats.add_command(msg, time.perf_counter() - t0)
+        return self.parse_response(msg, resp, dt)
+
+    def command_burst(self, cmdlist, depth = None):
+        # cmdlist = [ (msg, dt), ... ] of read-only commands; up to <depth> requests are in flight
+        # cached getvar responses are returned without sending
+        # if loader fails on pipelined commands, streams are resynced and the rest is sent one by one
+        if depth is None:
+            depth = self.cmd_pipeline_depth
+        depth = max(depth, 1)
+        result = [ None ] * len(cmdlist)
+        todo = [ ]
+        for i, (msg, dt) in enumerate(cmdlist):
+            resp = self.getvar_cache.get(msg) if self.use_getvar_cache else None
+            if resp is not None:
+                result[i] = self.parse_response(msg, resp, dt)
+            else:
+                todo.append(i)
+        finished = set()
+        if depth > 1 and len(todo) > 1 and not self.cmd_pipeline_probed:
+            self.probe_pipeline()
+            depth = min(depth, self.cmd_pipeline_depth)
+        if depth > 1 and len(todo) > 1:
+            try:
+                self._send_burst(cmdlist, todo, result, finished, depth)
+                return result
+            except (RuntimeError, usb.core.USBError) as e:
+                log.warn(f'Pipelined commands failed: {e}. Pipelining disabled!')
+                self.cmd_pipeline_depth = 1
+                todo = [ i for i in todo if i not in finished ]
+        self._send_burst(cmdlist, todo, result, finished, 1)
+        return result
+
+    def _send_burst(self, cmdlist, todo, result, finished, depth):
+        sent = [ ]   # send time of commands
+        done = 0
+        try:
+            for num, i in enumerate(todo):
+                msg, dt = cmdlist[i]
+                while len(sent) < len(todo) and len(sent) - num < depth:
+                    self.check_caches(cmdlist[todo[len(sent)]][0])
+                    sent.append(time.perf_counter())
+                    self.write(cmdlist[todo[len(sent) - 1]][0])
+                resp = self.read()
+                done += 1
+                finished.add(i)
+                self.stats.add_command(msg, time.perf_counter() - sent[num])
+                self.cache_getvar(msg, resp)
+                result[i] = self.parse_response(msg, resp, dt)
+        except BaseException:
+            if depth > 1 and len(sent) > done:
+                self.drain_responses(len(sent) - done)
+            raise
+
+    def probe_pipeline(self):
+        # responses are not tagged: loader must answer every command sent ahead, in order
+        self.cmd_pipeline_probed = True
+        msg = 'getvar:max-download-size'
+        try:
+            self.write(msg)
+            self.write(msg)
+            resp = [ self.read(), self.read() ]
+            ok = resp[0].retcode == 0 and resp[0].data is not None and resp[1].data == resp[0].data
+        except (RuntimeError, usb.core.USBError) as e:
+            log.debug(f'Pipeline probe failed: {e}')
+            ok = False
+        if not ok:
+            log.warn(f'Loader does not support pipelined commands. Pipelining disabled!')
+            self.read_all_packets(self.epin, 100)
+            self.cmd_pipeline_depth = 1
+        return ok
+
+    def drain_responses(self, count):
+        # resync command/response stream: read responses of commands already sent
+        log.warn(f'Draining {count} outstanding responses')
+        for i in range(count):
+            try:
+                self.read()
+            except Exception:
+                break
+        self.read_all_packets(self.epin, 100)
+
+    def get_device_info(self, lazy = True):
+        info = DeviceInfo(self)
+        return info.fetch() if lazy else info.fetch_all()
+
+    def parse_response(self, msg, resp, dt = 'bytes'):
         un = ''
         if isinstance(msg, str):
             if msg.startswith('Read-TA:') or msg.startswith('Write-TA:'):
@@ -439,7 +871,6 @@ class SomcUsbDevice():
                 except Exception as e:
                     pass
 
-        resp = self.read()
         if resp.retcode < 0 or resp.data is None:
             log.error(f'CMD: {msg}{un}: [rc:{resp.retcode}] "{resp.errtext}"')
             return None
@@ -491,8 +922,29 @@ class SomcUsbDevice():
         log.info(f'Command "signature:<size>" NOT supported!')
         return False
 
-    def getvar(self, name, dt = 'str'):
-        return self.command('getvar:' + name, dt)
+    def getvar(self, name, dt = 'str', cache = True):
+        # cache = False: bypass cached value (fresh value is cached anyway)
+        msg = 'getvar:' + name
+        if cache and self.use_getvar_cache and msg in self.getvar_cache:
+            self.lastresp = self.getvar_cache[msg]
+            return self.parse_response(msg, self.lastresp, dt)
+        ret = self.command(msg, dt)
+        self.cache_getvar(msg, self.lastresp)
+        return ret
+
+    def cache_getvar(self, msg, resp):
+        if self.use_getvar_cache and isinstance(msg, str) and msg.startswith('getvar:'):
+            if resp.retcode == 0 and resp.data is not None:
+                self.getvar_cache[msg] = resp
+
+    def clear_getvar_cache(self, volatile_only = False):
+        if not volatile_only:
+            self.getvar_cache = { }
+            return
+        for msg in list(self.getvar_cache.keys()):
+            name = msg[7:]
+            if name in volatile_vars or name.split(':')[0] in volatile_vars:
+                del self.getvar_cache[msg]
         
     def ta_unit_addr(self, addr):
         if isinstance(addr, ta.TAUnit):
@@ -511,9 +963,31 @@ class SomcUsbDevice():
 
         raise RuntimeError(f'Incorrect type of TA unit addr: {type(addr)}')
     
+    def clear_ta_cache(self):
+        self.ta_cache = { }
+        self.ta_cache_parts = set()
+
+    def check_caches(self, msg):
+        # drop cached values which can be changed by command
+        if not self.ta_cache and not self.ta_cache_parts and not self.getvar_cache:
+            return
+        if isinstance(msg, bytes):
+            msg = msg.decode('latin-1')
+        name = msg.split(':')[0]
+        if name in ta_cache_reset_cmds and (self.ta_cache or self.ta_cache_parts):
+            log.debug(f'TA cache cleared. Reason: command "{msg}"')
+            self.clear_ta_cache()
+        if name in getvar_reset_cmds and self.getvar_cache:
+            self.clear_getvar_cache(volatile_only = True)
+
     def read_ta(self, addr):
         part, unit = self.ta_unit_addr(addr)
-        return self.command(f'Read-TA:{part}:{unit}')
+        if self.use_ta_cache and (part, unit) in self.ta_cache:
+            return self.ta_cache[(part, unit)]
+        data = self.command(f'Read-TA:{part}:{unit}')
+        if data is not None and self.use_ta_cache:
+            self.ta_cache[(part, unit)] = data
+        return data
         
     def set_current_slot(self, slot):
         if slot != 'a' and slot != 'b':
@@ -589,18 +1063,65 @@ class SomcUsbDevice():
                 file.write(txt) if txt else file.write('')
         return txt
         
-    def upload(self, data, sign = False, timeout = None):
+    def write_stream(self, stream, size):
+        # send data from file-like object or iterator of buffers without full in-memory materialization
+        wsize = 0
+        if hasattr(stream, 'read'):
+            wbuf = memoryview(bytearray(self.upload_window_size))
+            readinto = getattr(stream, 'readinto', None)
+            while wsize < size:
+                bsz = min(len(wbuf), size - wsize)
+                pos = 0
+                while pos < bsz:
+                    if readinto:
+                        rsz = readinto(wbuf[pos:bsz])
+                    else:
+                        buf = stream.read(bsz - pos)
+                        rsz = len(buf) if buf else 0
+                        wbuf[pos:pos+rsz] = buf
+                    if not rsz:
+                        raise RuntimeError(f'Unexpected end of stream! Readed {wsize + pos} bytes, expected: {size}')
+                    pos += rsz
+                self.raw_write(wbuf[:bsz])
+                wsize += bsz
+        else:
+            for buf in stream:
+                if not buf:
+                    continue
+                if wsize + len(buf) > size:
+                    raise RuntimeError(f'Stream too large! Size > {wsize + len(buf)}, expected: {size}')
+                self.raw_write(buf)
+                wsize += len(buf)
+
+        if wsize != size:
+            raise RuntimeError(f'Stream size = {wsize}, expected: {size}')
+
+    def upload(self, data, sign = False, timeout = None, size = None):
         self.upbuf = b''
         if isinstance(data, str):
             data = data.encode()
-    
-        dsize = len(data)
+
+        stream = None
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            # file-like object or iterator of buffers
+            stream = data
+            if size is None:
+                if not hasattr(stream, 'seek'):
+                    raise ValueError(f'Size of stream for upload not specified!')
+                pos = stream.tell()
+                size = stream.seek(0, os.SEEK_END) - pos
+                stream.seek(pos)
+            dsize = size
+        else:
+            dsize = len(data)
+
         if dsize >= self.max_download_size:
             raise RuntimeError(f'Error on UPLOAD command: Too large data size = {dsize}, max = {self.max_download_size}')
 
         dsizehex = f'{dsize:08X}'
         cmdname = 'download' if not sign else 'signature'
         msg = f'{cmdname}:{dsizehex}'
+        t0 = time.perf_counter()
         self.write(msg)
         
         resp = self.read(onepkt = True, timeout = timeout)
@@ -611,24 +1132,80 @@ class SomcUsbDevice():
         if resp.data != dsizehex.encode():
             raise RuntimeError(f' Error: {cmdname} DATA reply size: {resp.data}, expected: "{dsizehex}"')
 
+        t1 = time.perf_counter()
         if dsize > 0:
-            self.write(data)
+            if stream is not None:
+                self.write_stream(stream, dsize)
+            else:
+                self.write(data)
 
+        t2 = time.perf_counter()
         resp = self.read(onepkt = True, timeout = timeout)
+        t3 = time.perf_counter()
+        self.stats.add_upload(dsize, t1 - t0, t2 - t1, t3 - t2)
+        self.stats.add_command(cmdname, t3 - t0)
         if resp.retcode != 0 or resp.errtext != '':
             if sign:
                 log.error(f'resp.errtext: "{resp.errtext}"')
                 return False
             raise RuntimeError(f'ERROR on {cmdname} command: {str(self.lastresp)}')
 
-        self.upbuf = data[:]   # copy bytearray
+        if stream is None and not isinstance(data, memoryview):
+            self.upbuf = data[:]   # copy bytearray
         log.debug(f'{cmdname} command comleted! Size = {dsize}')
         return True
 
     def write_ta(self, addr, data):
         part, unit = self.ta_unit_addr(addr)
+        self.ta_cache.pop((part, unit), None)
         self.upload(data)
-        return self.command(f'Write-TA:{part}:{unit}')
+        ret = self.command(f'Write-TA:{part}:{unit}')
+        if ret is None:
+            self.ta_cache_parts.discard(part)
+        elif self.use_ta_cache:
+            self.ta_cache[(part, unit)] = bytes(data)
+        return ret
+
+    def read_all_ta(self, part):
+        # returns dict: code => value
+        if self.use_ta_cache and part in self.ta_cache_parts:
+            return { code: value for (p, code), value in self.ta_cache.items() if p == part }
+        data = self.command(f'Read-all-TA:{part}')
+        if data is None:
+            return None
+        units = { unit.code: unit.value for unit in ta.parse_dump(data, part) }
+        if self.use_ta_cache:
+            for code, value in units.items():
+                self.ta_cache[(part, code)] = value
+            self.ta_cache_parts.add(part)
+        return units
+
+    def write_ta_diff(self, ulist, test = False):
+        # write only units which value differs from value on device
+        report = { 'written': [ ], 'skipped': [ ] }
+        current = { }
+        for unit in ulist:
+            if unit.part not in current:
+                current[unit.part] = self.read_all_ta(unit.part)
+                if current[unit.part] is None:
+                    log.warn(f'Cannot read TA partition {unit.part}: {self.lastresp}. All units will be written!')
+            units = current[unit.part]
+            value = unit.value or b''
+            if units is not None and units.get(unit.code) == value:
+                log.debug(f'  Skip TA unit {unit.part}:{unit.code}. Reason: value not changed')
+                report['skipped'].append(unit)
+                continue
+            cmd = f'Write-TA:{unit.part}:{unit.code}'
+            log.info(f'CMD: {cmd}   <size = {len(value)}>')
+            if not test:
+                ret = self.write_ta(unit, value)
+                if ret is None:
+                    raise RuntimeError(f'Cannot {cmd} ! Error: {str(self.lastresp)}')
+                if units is not None:
+                    units[unit.code] = value
+            report['written'].append(unit)
+        log.info(f'TA units written: {len(report["written"])}, skipped (unchanged): {len(report["skipped"])}')
+        return report
     
     def check_sign_upload(self):
         ret = self.upload(b'\x00\x00\x00\x03', sign = True)
@@ -636,12 +1213,25 @@ class SomcUsbDevice():
             log.error(f'CMD: signature: {self.lastresp}')   # <None,-1,"Failed to verify cms">
 
     def powerdown(self):
+        self.clear_ta_cache()
+        self.clear_getvar_cache()
         self.raw_write(b'powerdown')
         self.raw_read(0, 50)
 
 
 opt = None
 
+def get_usb_dev_path(dev):
+    if dev.port_numbers:
+        return f'{dev.bus}-' + '.'.join([ str(pn) for pn in dev.port_numbers ])
+    return f'{dev.bus}-{dev.address}'
+
+def get_usb_dev_serial(dev):
+    try:
+        return dev.serial_number
+    except Exception:
+        return None
+
 def activate_usb_backend_logger(level = logging.DEBUG):
     logger = logging.getLogger('usb')
     logger.setLevel(level)
@@ -653,37 +1243,7 @@ def activate_usb_backend_logger(level = logging.DEBUG):
 
 def somc_usb_test(sud):
     #activate_usb_backend_logger(level = logging.DEBUG)
-    max_download_size = sud.getvar('max-download-size')
-    sector_size = sud.getvar('Sector-size')
-    product = sud.getvar('product')
-    version = sud.getvar('version')
-    blver = sud.getvar('version-bootloader')
-    bbver = sud.getvar('version-baseband')
-    serialno = sud.getvar('serialno')
-    secure = sud.getvar('secure')
-    loader_ver = sud.getvar('Loader-version')
-    phone_id = sud.getvar('Phone-id')
-    device_id = sud.getvar('Device-id')
-    platform_id = sud.getvar('Platform-id')
-    rooting_status = sud.getvar('Rooting-status')
-    ufs_info = sud.getvar('Ufs-info')
-    emmc_info = sud.getvar('Emmc-info')
-    def_security = sud.getvar('Default-security')
-    keystore_counter = sud.getvar('Keystore-counter')
-    security_state = sud.getvar('Security-state')
-
-    sud.getvar('Stored-security-state')
-    sud.getvar('Keystore-xcs')
-
-    s1_root = sud.getvar('S1-root')
-    sake_root = sud.getvar('Sake-root')
-    root_key_hash = sud.command('Get-root-key-hash')   # PLF_ROOT_HASH
-    slot_count = sud.getvar('slot-count')
-    current_slot = sud.getvar('current-slot')
-    battery_level = sud.getvar('Battery')
-    sud.getvar('Frp-partition')
-    sud.getvar('X-conf')
-    sud.getvar('Soc-unique-id')
+    info = sud.get_device_info(lazy = False)
 
     #sud.command('Get-gpt-info:0')
     #sud.command('Get-gpt-info:1')
@@ -788,6 +1348,8 @@ if __name__ == '__main__':
     parser.add_option("-v", "--value", dest = "value", default = None, type = "string")
     parser.add_option("-f", "--file", dest = "filename", default = None, type = "string")
     parser.add_option("", "--ta", dest = "ta_file", default = None, type = "string")
+    parser.add_option("", "--ta-full", dest = "ta_full", action="store_true", default = False)  # write all units of ta-file
+    parser.add_option("", "--rcs", dest = "read_chunk_size", default = 1024*1024, type = "int")  # 0 = wMaxPacketSize
     (opt, args) = parser.parse_args() 
     
     try:
@@ -806,6 +1368,7 @@ if __name__ == '__main__':
         sud.read_timeout = rt
         log.info(f'Set write timeout = {wt} ms')
         sud.write_timeout = wt
+        sud.read_chunk_size = opt.read_chunk_size
 
         sud.connect()
 
@@ -820,6 +1383,10 @@ if __name__ == '__main__':
             log.info(f'----- action: dump_all_ta ------')
             sud.dump_all_ta()
         
+        elif opt.action == 'tune':
+            log.info(f'----- action: tune_write_chunk_size ------')
+            sud.tune_write_chunk_size(sud.getvar('product'), force = True)
+
         elif opt.action == 'pwdn' or opt.action == 'powerdown':
             log.info(f'----- action: powerdown ------')
             sud.powerdown()
@@ -868,8 +1435,13 @@ if __name__ == '__main__':
             taulist = ta.load_from_file(opt.ta_file)
             if not taulist:
                 raise RuntimeError(f'Incorrect ta-file "{opt.ta_file}"')
-            for tau in taulist:
-                set_ta_unit_value(sud, opt, tau)
+            if opt.ta_full:
+                for tau in taulist:
+                    set_ta_unit_value(sud, opt, tau)
+            else:
+                if opt.test:
+                    log.warning(f'----- READONLY MODE ACTIVE! Reason: test = {opt.test} -----')
+                sud.write_ta_diff(taulist, test = bool(opt.test))
         
         else:
             log.error(f'Incorrect cmdline options!')
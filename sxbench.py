@@ -0,0 +1,339 @@
+import os
+import sys
+import io
+import time
+import json
+import shutil
+import tarfile
+import platform
+import threading
+import tempfile
+from os import path as osp
+
+import logging
+import logcfg
+from logcfg import log
+
+import somcusb
+import sxflasher
+import sxemu
+
+
+MiB = 1024*1024
+
+# name => (gzip, list of chunk sizes of system image)
+fw_profiles = {
+    'tar-huge':   ( False, [ 128*MiB, 32*MiB ] ),
+    'gz-huge':    ( True,  [ 128*MiB, 32*MiB ] ),
+    'tar-small':  ( False, [ MiB ] * 160 ),
+    'gz-small':   ( True,  [ MiB ] * 160 ),
+}
+
+upload_profiles = {
+    'upload-4k':  ( 4*1024, 2048 ),   # chunk size, count
+    'upload-1m':  ( MiB, 256 ),
+    'upload-64m': ( 64*MiB, 4 ),
+}
+
+def get_anon_rss():
+    # resident anonymous memory: file-backed pages of mapped SIN-files and hot cache are not counted
+    try:
+        with open('/proc/self/status', 'r') as file:
+            for line in file:
+                if line.startswith('RssAnon:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def get_max_rss():
+    # fallback for hosts without procfs (includes file-backed pages)
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class MemSampler():
+    # kernel keeps no high-water mark for RssAnon: peak is sampled by background thread
+    def __init__(self, interval = 0.005):
+        self.interval = interval
+        self.peak = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.peak = get_anon_rss()
+        if self.peak is None:
+            return
+        self.thread = threading.Thread(target = self._worker, name = 'MemSampler', daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.thread:
+            return get_max_rss()
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        self._sample()
+        return self.peak
+
+    def _sample(self):
+        rss = get_anon_rss()
+        if rss and rss > self.peak:
+            self.peak = rss
+
+    def _worker(self):
+        while not self.stop_event.wait(self.interval):
+            self._sample()
+
+def make_data(size, pattern):
+    # half random, half zeros: compresses to ~50% like real images
+    out = bytearray()
+    while len(out) < size:
+        out += pattern[:size - len(out)]
+    return out
+
+def make_sin(filename, imgname, sizes, gz, pattern):
+    with tarfile.open(filename, 'w:gz' if gz else 'w') as tar:
+        def add(name, data):
+            ti = tarfile.TarInfo(name)
+            ti.size = len(data)
+            tar.addfile(ti, io.BytesIO(data))
+        add(f'{imgname}.cms', b'\x30\x82' + b'\x00' * 0x100)
+        for num, size in enumerate(sizes):
+            add(f'{imgname}.{num:03d}', make_data(size, pattern))
+
+def make_firmware(wdir, gz, sizes):
+    pattern = os.urandom(MiB // 2) + bytes(MiB // 2)
+    os.makedirs(osp.join(wdir, 'boot'))
+    os.makedirs(osp.join(wdir, 'partition'))
+    make_sin(osp.join(wdir, 'system.sin'), 'system', sizes, gz, pattern)
+    make_sin(osp.join(wdir, 'boot', 'bootloader.sin'), 'bootloader', [ 4*MiB ], gz, pattern)
+    make_sin(osp.join(wdir, 'partition', 'partition-image-LUN0_X-FLASH-ALL-1.sin'), 'partitionimage_0', [ 0x6000 ], gz, pattern)
+    with open(osp.join(wdir, 'update.xml'), 'w') as file:
+        file.write('<UPDATE><SIN>system.sin</SIN></UPDATE>\n')
+    with open(osp.join(wdir, 'cust.ta'), 'w') as file:
+        file.write('02\n00000907 0001 00\n')
+    with open(osp.join(wdir, 'partition', 'partition_delivery.xml'), 'w') as file:
+        file.write('<PARTITION_DELIVERY FORMAT="1"><PARTITION_IMAGES>'
+                   '<FILE PATH="partition-image-LUN0_X-FLASH-ALL-1.sin"/></PARTITION_IMAGES></PARTITION_DELIVERY>\n')
+    with open(osp.join(wdir, 'boot', 'cfg.ta'), 'w') as file:
+        file.write('02\n000008FD 0004 01 02 03 04\n')
+    with open(osp.join(wdir, 'boot', 'boot_delivery.xml'), 'w') as file:
+        file.write('<BOOT_DELIVERY FORMAT="1" PRODUCT="EMU" SPACE_ID="EMU" VERSION="1">'
+                   '<CONFIGURATION NAME="emu"><BOOT_CONFIG><FILE PATH="cfg.ta"/></BOOT_CONFIG>'
+                   '<BOOT_IMAGES><FILE PATH="bootloader.sin"/></BOOT_IMAGES>'
+                   '<ATTRIBUTES VALUE="DEFAULT_SECURITY=&quot;OFF&quot;"/></CONFIGURATION></BOOT_DELIVERY>\n')
+
+def make_emu_backend(opt):
+    usb_backend = sxemu.get_backend()
+    for dev in usb_backend.devices:
+        dev.bandwidth = opt['bandwidth']
+        dev.latency = opt['latency']
+        dev.cmd_latency = opt['cmd_latency']
+    return usb_backend
+
+def run_upload(name, opt):
+    chunk_size, count = upload_profiles[name]
+    sud = somcusb.SomcUsbDevice(loglevel = opt['loglevel'])
+    sud.usb_backend = make_emu_backend(opt)
+    sud.write_chunk_size = opt['write_chunk_size']
+    sud.connect()
+    data = os.urandom(chunk_size)
+    t0 = time.perf_counter()
+    c0 = time.process_time()
+    for i in range(count):
+        sud.upload(data)
+    return { 'wall': time.perf_counter() - t0, 'cpu': time.process_time() - c0, 'bytes': chunk_size * count }
+
+def run_flash(name, opt):
+    wdir = osp.join(opt['fwdir'], name)
+    sxf = sxflasher.SXFlasher(loglevel = opt['loglevel'])
+    sxf.test = 0
+    sxf.use_hotcache = opt['hotcache']
+    sxf.use_fwcache = opt['fwcache']
+    sxf.write_chunk_size = opt['write_chunk_size']
+    sxf.sud.usb_backend = make_emu_backend(opt)
+    t0 = time.perf_counter()
+    c0 = time.process_time()
+    sxf.flash_stock(wdir)
+    res = { 'wall': time.perf_counter() - t0, 'cpu': time.process_time() - c0 }
+    res['bytes'] = sxf.sud.stats.uploads['bytes']
+    return res
+
+def run_case(name, opt):
+    # executed in separate process: peak memory belongs to this case only
+    logcfg.redirect_to_file(logcfg.get_log_filename(f'__bench_{name}'))
+    log.set_level(opt['loglevel'] if opt['loglevel'] else logging.CRITICAL)
+    sampler = MemSampler()
+    sampler.start()
+    try:
+        if name in upload_profiles:
+            res = run_upload(name, opt)
+        else:
+            res = run_flash(name, opt)
+    finally:
+        mem = sampler.stop()
+    res['mem'] = mem
+    return res
+
+
+class Benchmark():
+    def __init__(self, loglevel = logging.CRITICAL):
+        self.repeat = 3
+        self.fwdir = None
+        self.keep_fw = False
+        self.opt = {
+            'loglevel': loglevel,
+            'bandwidth': 0,          # bytes per second (0 = unlimited)
+            'latency': 0.000125,
+            'cmd_latency': 0.0005,
+            'write_chunk_size': 0,
+            'hotcache': False,
+            'fwcache': True,
+        }
+
+    def prepare(self, cases):
+        if not self.fwdir:
+            self.fwdir = tempfile.mkdtemp(prefix = 'sxbench_')
+        self.opt['fwdir'] = self.fwdir
+        for name in cases:
+            if name not in fw_profiles:
+                continue
+            wdir = osp.join(self.fwdir, name)
+            if osp.isdir(wdir):
+                continue
+            log.info(f'Create firmware "{name}" ...')
+            gz, sizes = fw_profiles[name]
+            make_firmware(wdir, gz, sizes)
+            if self.opt['hotcache']:
+                sxf = sxflasher.SXFlasher(loglevel = self.opt['loglevel'])
+                sxf.wdir = wdir
+                sxf.prepare()
+
+    def cleanup(self):
+        if self.fwdir and not self.keep_fw:
+            shutil.rmtree(self.fwdir, ignore_errors = True)
+
+    def run(self, cases):
+        import multiprocessing
+        import concurrent.futures
+        self.prepare(cases)
+        results = { }
+        ctx = multiprocessing.get_context('spawn')
+        for name in cases:
+            runs = [ ]
+            for i in range(self.repeat):
+                with concurrent.futures.ProcessPoolExecutor(max_workers = 1, mp_context = ctx) as pool:
+                    runs.append(pool.submit(run_case, name, self.opt).result())
+            best = min(runs, key = lambda res: res['wall'])
+            res = dict(best)
+            res['mbps'] = res['bytes'] / res['wall'] / 1e6 if res['wall'] > 0 else None
+            res['mem'] = max([ run['mem'] or 0 for run in runs ]) or None
+            res['runs'] = len(runs)
+            results[name] = res
+            log.info(f'{name}: {self.format_result(res)}')
+        return results
+
+    def format_result(self, res):
+        mem = f'{res["mem"] / MiB:.0f} MiB' if res['mem'] else '-'
+        return f'wall {res["wall"]:.3f}s  cpu {res["cpu"]:.3f}s  {res["mbps"]:.1f} MB/s  mem {mem}'
+
+    def get_report(self, results):
+        info = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'node': platform.node(),
+        }
+        opt = { k: v for k, v in self.opt.items() if k not in [ 'fwdir', 'loglevel' ] }
+        return { 'info': info, 'opt': opt, 'results': results }
+
+    def save(self, filename, results):
+        with open(filename, 'w', encoding = 'utf-8') as file:
+            json.dump(self.get_report(results), file, indent = 4)
+
+    def compare(self, results, baseline, threshold = 5.0):
+        # returns list of cases slower than baseline by more than threshold percent
+        base = baseline['results']
+        rows = [ ]
+        regressions = [ ]
+        for name, res in results.items():
+            if name not in base:
+                continue
+            old = base[name]
+            row = [ name ]
+            for key in [ 'wall', 'cpu', 'mbps', 'mem' ]:
+                if not old.get(key) or not res.get(key):
+                    row.append('-')
+                    continue
+                delta = (res[key] - old[key]) * 100.0 / old[key]
+                row.append(f'{delta:+.1f}%')
+            rows.append(row)
+            if res['wall'] > base[name]['wall'] * (1 + threshold / 100.0):
+                regressions.append(name)
+        header = [ 'CASE', 'WALL', 'CPU', 'MB/S', 'MEM' ]
+        widths = [ max([ len(row[i]) for row in rows + [ header ] ]) for i in range(len(header)) ]
+        fmt = '  '.join([ f'{{:<{w}}}' for w in widths ])
+        log.info(fmt.format(*header))
+        for row in rows:
+            log.info(fmt.format(*row))
+        return regressions
+
+
+if __name__ == '__main__':
+    import optparse
+    parser = optparse.OptionParser("usage: %prog [options] [cases]", add_help_option = False)
+    parser.add_option("-n", "--repeat", dest = "repeat", default = 3, type = "int")
+    parser.add_option("-f", "--fwdir", dest = "fwdir", default = "", type = "string")  # synthetic firmware dir (kept)
+    parser.add_option("-o", "--out", dest = "out", default = "", type = "string")
+    parser.add_option("-b", "--baseline", dest = "baseline", default = "", type = "string")
+    parser.add_option("", "--threshold", dest = "threshold", default = 5.0, type = "float")  # percent
+    parser.add_option("", "--bw", dest = "bandwidth", default = 0, type = "int")  # emulated link bandwidth in MB/s (0 = unlimited)
+    parser.add_option("", "--latency", dest = "latency", default = 125, type = "int")  # usec per bulk transfer
+    parser.add_option("-w", "--wcs", dest = "write_chunk_size", default = 0, type = "int")
+    parser.add_option("", "--hotcache", dest = "hotcache", action="store_true", default = False)
+    parser.add_option("-L", "--loglevel", dest = "loglevel", default = 0, type = "int")
+    parser.add_option("-l", "--list", dest = "list", action="store_true", default = False)
+    (opt, args) = parser.parse_args()
+
+    log.set_level(opt.loglevel if opt.loglevel else logging.INFO)
+    all_cases = list(upload_profiles.keys()) + list(fw_profiles.keys())
+    if opt.list:
+        for name in all_cases:
+            log.info(name)
+        exit(0)
+
+    cases = args if args else all_cases
+    for name in cases:
+        if name not in all_cases:
+            log.error(f'Unknown benchmark case "{name}"')
+            exit(1)
+
+    bench = Benchmark(loglevel = opt.loglevel)
+    bench.repeat = max(opt.repeat, 1)
+    bench.fwdir = opt.fwdir if opt.fwdir else None
+    bench.keep_fw = bool(opt.fwdir)
+    bench.opt['bandwidth'] = opt.bandwidth * 1000*1000
+    bench.opt['latency'] = opt.latency / 1e6
+    bench.opt['write_chunk_size'] = opt.write_chunk_size
+    bench.opt['hotcache'] = opt.hotcache
+    try:
+        results = bench.run(cases)
+    finally:
+        bench.cleanup()
+
+    if opt.out:
+        bench.save(opt.out, results)
+        log.info(f'Results saved to "{opt.out}"')
+
+    if opt.baseline:
+        with open(opt.baseline, 'r', encoding = 'utf-8') as file:
+            baseline = json.load(file)
+        regressions = bench.compare(results, baseline, opt.threshold)
+        if regressions:
+            log.error(f'Regressions (wall > {opt.threshold}%): {", ".join(regressions)}')
+            exit(2)
@@ -0,0 +1,371 @@
+import os
+import sys
+import time
+import zlib
+import errno
+import ctypes
+import logging
+import collections
+
+import pyusb.backend as backend
+import pyusb.util as util
+from pyusb._debug import methodtrace
+from pyusb.core import USBError, USBTimeoutError
+
+
+__all__ = [ 'get_backend', 'EmuDevice' ]
+
+_logger = logging.getLogger('usb.backend.sxemu')
+
+# ==================================================================================
+
+class _Desc(object):
+    def __init__(self, **fields):
+        self.extra_descriptors = None
+        self.__dict__.update(fields)
+
+_ETIMEDOUT = getattr(errno, 'ETIMEDOUT', 110)
+
+def _timeout_error():
+    return USBTimeoutError('Operation timed out', -7, _ETIMEDOUT)
+
+# ==================================================================================
+
+class EmuDevice(object):
+    # emulated SOMC XFL device (protocol: OKAY/FAIL/DATA)
+    def __init__(self, serialno = 'EMU0000001', port = 1):
+        self.serialno = serialno
+        self.port = port
+        self.idVendor = 0x0FCE
+        self.idProduct = 0xB00B
+        self.wMaxPacketSize = 512
+        self.bandwidth = 40*1000*1000  # bytes per second of USB link (0 = unlimited)
+        self.latency = 0.000125        # seconds per bulk transfer (host <-> device turnaround)
+        self.cmd_latency = 0.001       # seconds of command processing
+        self.rpmb_latency = 0.01       # seconds of RPMB read (some getvars)
+        self.flash_speed = 0           # bytes per second of flash write (0 = instant)
+        self.max_download_size = 400*1024*1024
+        self.keep_download = 16*1024*1024  # max size of download payload kept in memory
+        self.vars = {
+            'max-download-size': str(self.max_download_size),
+            'Sector-size': '4096',
+            'product': 'XQ-EMU',
+            'version': '0.5',
+            'version-bootloader': '1311-5555_X_Boot_SM8250_LA1.1_Q_79',
+            'version-baseband': '1311-5555',
+            'serialno': serialno,
+            'secure': 'yes',
+            'Loader-version': 'EMU',
+            'Phone-id': '0000:00000000000000',
+            'Device-id': '0000000000000000',
+            'Platform-id': '0x000000000000',
+            'Rooting-status': 'NOT_ROOTABLE',
+            'Ufs-info': 'EMU-UFS',
+            'Emmc-info': '',
+            'Default-security': 'OFF',
+            'Keystore-counter': '1',
+            'Security-state': 'NOT_ROOTABLE',
+            'Stored-security-state': 'NOT_ROOTABLE',
+            'Keystore-xcs': 'EMU',
+            'S1-root': 'EMU',
+            'Sake-root': 'EMU',
+            'slot-count': '2',
+            'current-slot': 'a',
+            'Battery': '80',
+            'Frp-partition': '',
+            'X-conf': '',
+            'Soc-unique-id': '0000000000000000',
+        }
+        self.rpmb_vars = [ 'Rooting-status', 'Keystore-counter', 'Security-state', 'Stored-security-state', 'Keystore-xcs', 'Sake-root' ]
+        self.slot_parts = [ 'boot', 'system', 'vendor', 'modem', 'dsp', 'bluetooth', 'rdimage', 'bootloader' ]
+        self.ta = { (2, 2050): b'', (2, 2475): b'emulated flash log' }
+        self.ufs_lun0_size = 0x100000   # sectors
+        self.root_key_hash = bytes(32)
+        self.reset()
+
+    def reset(self):
+        self.out = collections.deque()   # responses to host
+        self.dl_remain = None            # remaining size of download payload
+        self.dl_data = bytearray()
+        self.dl_size = 0
+        self.dl_crc = 0
+        self.dl_sign = False
+        self.signature = None
+        self.busy_until = 0.0
+        self.log = [ ]     # processed commands
+        self.flashed = { } # partition => (size, crc32)
+
+    def spend(self, seconds):
+        # emulate link/device time: sleep only when emulated clock is ahead by more than 1 ms
+        now = time.perf_counter()
+        self.busy_until = max(self.busy_until, now) + seconds
+        delay = self.busy_until - now
+        if delay > 0.001:
+            time.sleep(delay)
+
+    def wire_time(self, size):
+        return self.latency + (size / self.bandwidth if self.bandwidth else 0)
+
+    def okay(self, data = b''):
+        self.out.append(b'OKAY' + data)
+
+    def fail(self, msg):
+        self.out.append(b'FAIL' + msg.encode('latin-1'))
+
+    def send_data(self, data):
+        self.out.append(b'DATA' + f'{len(data):08X}'.encode())
+        if data:
+            self.out.append(bytes(data))
+        self.okay()
+
+    def write(self, buf):
+        self.spend(self.wire_time(len(buf)))
+        if self.dl_remain is not None:
+            return self.download_data(buf)
+        cmd = bytes(buf).decode('latin-1')
+        self.log.append(cmd)
+        self.spend(self.cmd_latency)
+        self.command(cmd)
+        return len(buf)
+
+    def read(self, size):
+        if not self.out:
+            raise _timeout_error()
+        data = self.out.popleft()
+        if len(data) > size:
+            self.out.appendleft(data[size:])
+            data = data[:size]
+        self.spend(self.wire_time(len(data)))
+        return data
+
+    def download_data(self, buf):
+        size = min(len(buf), self.dl_remain)
+        if self.dl_size <= self.keep_download:
+            self.dl_data += bytes(buf[:size])
+        self.dl_crc = zlib.crc32(buf[:size], self.dl_crc)
+        self.dl_remain -= size
+        if self.dl_remain == 0:
+            self.dl_remain = None
+            if self.dl_sign:
+                self.signature = bytes(self.dl_data)
+            self.okay()
+        return size
+
+    def command(self, cmd):
+        name, _, arg = cmd.partition(':')
+        if name in [ 'download', 'signature' ] and arg:
+            size = int(arg, 16)
+            if size >= self.max_download_size:
+                return self.fail(f'Data too large')
+            self.dl_size = size
+            self.dl_data = bytearray()
+            self.dl_crc = 0
+            self.dl_sign = name == 'signature'
+            self.out.append(b'DATA' + f'{size:08X}'.encode())
+            if size == 0:
+                return self.okay()
+            self.dl_remain = size
+            return
+
+        if name == 'signature':
+            self.signature = bytes(self.dl_data)
+            return self.okay()
+
+        if name == 'getvar':
+            if arg.startswith('has-slot:'):
+                return self.okay(b'yes' if arg[9:] in self.slot_parts else b'no')
+            if arg not in self.vars:
+                return self.fail('Variable not found')
+            if arg in self.rpmb_vars:
+                self.spend(self.rpmb_latency)
+            return self.okay(self.vars[arg].encode('latin-1'))
+
+        if name in [ 'flash', 'Repartition' ]:
+            if self.flash_speed:
+                self.spend(self.dl_size / self.flash_speed)
+            self.flashed[arg] = ( self.dl_size, self.dl_crc )
+            return self.okay()
+
+        if name == 'erase':
+            self.flashed.pop(arg, None)
+            return self.okay()
+
+        if name == 'Read-TA':
+            part, code = [ int(x) for x in arg.split(':') ]
+            if (part, code) not in self.ta:
+                return self.fail('Unit not found')
+            self.spend(self.rpmb_latency)
+            return self.send_data(self.ta[(part, code)])
+
+        if name == 'Read-all-TA':
+            part = int(arg)
+            dump = bytearray()
+            for (p, code), value in sorted(self.ta.items()):
+                if p == part:
+                    dump += code.to_bytes(4, 'big') + len(value).to_bytes(4, 'big') + value
+            return self.send_data(dump)
+
+        if name == 'Write-TA':
+            part, code = [ int(x) for x in arg.split(':') ]
+            self.ta[(part, code)] = bytes(self.dl_data)
+            return self.okay()
+
+        if name == 'set_active':
+            self.vars['current-slot'] = arg
+            return self.okay()
+
+        if name == 'Get-root-key-hash':
+            return self.send_data(self.root_key_hash)
+
+        if name == 'Getlog':
+            return self.send_data(b'emulated device log')
+
+        if name == 'Get-ufs-info':
+            desc = bytearray(0x40)
+            desc[0] = 0x10
+            desc[0x2C:0x30] = self.ufs_lun0_size.to_bytes(4, 'big')
+            return self.send_data(desc)
+
+        if name in [ 'Get-emmc-info', 'Get-gpt-info' ]:
+            return self.fail('Not supported')
+
+        if name in [ 'Sync', 'powerdown', 'reboot-bootloader', 'continue' ]:
+            return self.okay()
+
+        return self.fail(f'Unknown command')
+
+# ==================================================================================
+
+class _DeviceHandle(object):
+    def __init__(self, dev):
+        self.dev = dev
+
+class _EmuBackend(backend.IBackend):
+    @methodtrace(_logger)
+    def __init__(self, devices):
+        backend.IBackend.__init__(self)
+        self.devices = devices
+
+    @methodtrace(_logger)
+    def enumerate_devices(self):
+        return iter(self.devices)
+
+    @methodtrace(_logger)
+    def get_device_descriptor(self, dev):
+        return _Desc(bLength = 18, bDescriptorType = util.DESC_TYPE_DEVICE, bcdUSB = 0x0210,
+                     bDeviceClass = 0, bDeviceSubClass = 0, bDeviceProtocol = 0, bMaxPacketSize0 = 64,
+                     idVendor = dev.idVendor, idProduct = dev.idProduct, bcdDevice = 0x0100,
+                     iManufacturer = 0, iProduct = 0, iSerialNumber = 1, bNumConfigurations = 1,
+                     bus = 1, address = dev.port + 1, port_number = dev.port, port_numbers = ( dev.port, ), speed = 3)
+
+    @methodtrace(_logger)
+    def get_configuration_descriptor(self, dev, config):
+        if config != 0:
+            raise IndexError('Invalid configuration index ' + str(config))
+        return _Desc(bLength = 9, bDescriptorType = util.DESC_TYPE_CONFIG, wTotalLength = 32, bNumInterfaces = 1,
+                     bConfigurationValue = 1, iConfiguration = 0, bmAttributes = 0x80, bMaxPower = 250)
+
+    @methodtrace(_logger)
+    def get_interface_descriptor(self, dev, intf, alt, config):
+        if intf != 0:
+            raise IndexError('Invalid interface index ' + str(intf))
+        if alt != 0:
+            raise IndexError('Invalid alternate setting index ' + str(alt))
+        return _Desc(bLength = 9, bDescriptorType = util.DESC_TYPE_INTERFACE, bInterfaceNumber = 0, bAlternateSetting = 0,
+                     bNumEndpoints = 2, bInterfaceClass = 0xFF, bInterfaceSubClass = 0x42, bInterfaceProtocol = 0x03, iInterface = 0)
+
+    @methodtrace(_logger)
+    def get_endpoint_descriptor(self, dev, ep, intf, alt, config):
+        if ep > 1:
+            raise IndexError('Invalid endpoint index ' + str(ep))
+        return _Desc(bLength = 7, bDescriptorType = util.DESC_TYPE_ENDPOINT, bEndpointAddress = 0x81 if ep == 0 else 0x01,
+                     bmAttributes = util.ENDPOINT_TYPE_BULK, wMaxPacketSize = dev.wMaxPacketSize, bInterval = 0, bRefresh = 0, bSynchAddress = 0)
+
+    @methodtrace(_logger)
+    def open_device(self, dev):
+        return _DeviceHandle(dev)
+
+    @methodtrace(_logger)
+    def close_device(self, dev_handle):
+        pass
+
+    @methodtrace(_logger)
+    def set_configuration(self, dev_handle, config_value):
+        pass
+
+    @methodtrace(_logger)
+    def get_configuration(self, dev_handle):
+        return 1
+
+    @methodtrace(_logger)
+    def set_interface_altsetting(self, dev_handle, intf, altsetting):
+        pass
+
+    @methodtrace(_logger)
+    def claim_interface(self, dev_handle, intf):
+        pass
+
+    @methodtrace(_logger)
+    def release_interface(self, dev_handle, intf):
+        pass
+
+    @methodtrace(_logger)
+    def bulk_write(self, dev_handle, ep, intf, data, timeout):
+        address, length = data.buffer_info()
+        length *= data.itemsize
+        return dev_handle.dev.write(memoryview((ctypes.c_char * length).from_address(address)).cast('B'))
+
+    @methodtrace(_logger)
+    def bulk_write_async(self, dev_handle, ep, intf, data, timeout, transfer_size, num_transfers):
+        # pipelined transfers: link latency is paid once per queue fill
+        dev = dev_handle.dev
+        address, length = data.buffer_info()
+        length *= data.itemsize
+        mv = memoryview((ctypes.c_char * length).from_address(address)).cast('B')
+        latency = dev.latency
+        try:
+            dev.latency = latency / num_transfers
+            pos = 0
+            while pos < length:
+                pos += dev.write(mv[pos:pos+transfer_size])
+        finally:
+            dev.latency = latency
+        return pos
+
+    @methodtrace(_logger)
+    def bulk_read(self, dev_handle, ep, intf, buff, timeout):
+        address, length = buff.buffer_info()
+        length *= buff.itemsize
+        data = dev_handle.dev.read(length)
+        ctypes.memmove(address, data, len(data))
+        return len(data)
+
+    @methodtrace(_logger)
+    def ctrl_transfer(self, dev_handle, bmRequestType, bRequest, wValue, wIndex, data, timeout):
+        # only GET_DESCRIPTOR(STRING) is supported: serial number
+        if bRequest != 0x06 or (wValue >> 8) != util.DESC_TYPE_STRING:
+            raise USBError('Pipe error', -9, errno.EPIPE)
+        index = wValue & 0xFF
+        if index == 0:
+            desc = b'\x04\x03\x09\x04'   # LANGID: en-US
+        else:
+            text = dev_handle.dev.serialno.encode('utf-16-le')
+            desc = bytes([ len(text) + 2, util.DESC_TYPE_STRING ]) + text
+        address, length = data.buffer_info()
+        length *= data.itemsize
+        size = min(length, len(desc))
+        ctypes.memmove(address, desc, size)
+        return size
+
+    @methodtrace(_logger)
+    def reset_device(self, dev_handle):
+        pass
+
+    @methodtrace(_logger)
+    def clear_halt(self, dev_handle, ep):
+        pass
+
+def get_backend(devices = None, num_devices = 1):
+    if devices is None:
+        devices = [ EmuDevice(serialno = f'EMU{i+1:07d}', port = i + 1) for i in range(num_devices) ]
+    return _EmuBackend(devices)
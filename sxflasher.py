@@ -2,17 +2,114 @@ import os
 import sys
 from os import path as osp
 
+import time
 import json
+import hashlib
 import gzip
-import zlib
-import tarfile
 import xml.etree.ElementTree as ET
 
 import logging
 from logcfg import log
+from datetime import datetime
 
 import somcusb
 import somcta as ta
+import sinfile
+import logcfg
+
+
+class Timeline():
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.start_time = time.time()
+        self.t0 = time.monotonic()
+        self.phases = [ ]
+        self.files = [ ]
+        self.phase = None
+
+    def now(self):
+        return time.monotonic() - self.t0
+
+    def begin(self, name):
+        self.end('ok')
+        self.phase = { 'name': name, 'start': self.now(), 'duration': None, 'status': None }
+        self.phases.append(self.phase)
+
+    def end(self, status = 'ok'):
+        if self.phase:
+            self.phase['duration'] = self.now() - self.phase['start']
+            self.phase['status'] = status
+            self.phase = None
+
+    def add_file(self, filename, start, size, status):
+        duration = self.now() - start
+        mbps = size / duration / 1e6 if duration > 0 else None
+        phase = self.phase['name'] if self.phase else None
+        self.files.append( { 'file': filename, 'phase': phase, 'start': start, 'duration': duration, 'bytes': size, 'mbps': mbps, 'status': status } )
+
+    def as_dict(self):
+        res = { }
+        res['start'] = datetime.fromtimestamp(self.start_time).isoformat(timespec = 'seconds')
+        res['duration'] = self.now()
+        res['phases'] = self.phases
+        res['files'] = self.files
+        return res
+
+
+class FlashJournal():
+    # checkpoint journal of completed flashing steps (used by resume mode)
+    version = 1
+
+    def __init__(self, wdir, serialno, fw_hash):
+        self.filename = osp.join(wdir, f'.sxf_journal__{serialno}.json')
+        self.serialno = serialno
+        self.fw_hash = fw_hash
+        self.steps = { }
+
+    def load(self):
+        try:
+            with open(self.filename, 'r', encoding = 'utf-8') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            log.warn(f'Cannot load journal "{self.filename}": {e}')
+            return False
+        if data.get('version') != self.version or data.get('serialno') != self.serialno:
+            return False
+        if data.get('fw_hash') != self.fw_hash:
+            log.warn(f'Journal "{osp.basename(self.filename)}" was created for another firmware')
+            return False
+        self.steps = data.get('steps', { })
+        return True
+
+    def save(self):
+        data = { 'version': self.version, 'serialno': self.serialno, 'fw_hash': self.fw_hash, 'steps': self.steps }
+        tmpfn = self.filename + f'.{os.getpid()}.tmp'
+        try:
+            with open(tmpfn, 'w', encoding = 'utf-8') as file:
+                json.dump(data, file, indent = 4)
+            os.replace(tmpfn, self.filename)
+        except OSError as e:
+            log.warn(f'Cannot save journal "{self.filename}": {e}')
+
+    def is_done(self, step):
+        return step in self.steps
+
+    def done(self, step):
+        self.steps[step] = datetime.now().isoformat(timespec = 'seconds')
+        self.save()
+
+    def remove(self):
+        self.steps = { }
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.warn(f'Cannot remove journal "{self.filename}": {e}')
 
 
 class SXFlasher():
@@ -23,10 +120,35 @@ class SXFlasher():
         self.sud = sud
         if not self.sud:
             self.sud = somcusb.SomcUsbDevice(loglevel = loglevel)
+        self.sud.use_ta_cache = True
         self.erase_user_data = False
         self.flashmode = False
         self.sync_timeout = 60  # 60 seconds
-        self.write_chunk_size = 0
+        self.write_chunk_size = 0   # -1 = auto
+        self.retune = False
+        self.preflight_check = True
+        self.preflight_workers = None  # None = number of CPUs
+        self.manifest = { }
+        self.use_fwcache = True
+        self.fwcache = None
+        self.updatexml = None  # (filename, size, mtime, index)
+        self.progress_callback = None  # func(stage)
+        self.chunk_cache = None  # sinfile.ChunkCache
+        self.use_hotcache = True
+        self.hotcache = None
+        self.log_suffix = ''   # suffix of session files in logs dir
+        self.timeline = Timeline()
+        self.resume = False   # skip steps completed in previous session (see FlashJournal)
+        self.journal = None
+        self.ta_diff = True   # write only changed TA units
+
+    def progress(self, stage):
+        if self.progress_callback:
+            self.progress_callback(stage)
+
+    def phase(self, name):
+        self.timeline.begin(name)
+        self.progress(name)
 
     def connect(self):
         if self.test < 100:
@@ -39,7 +161,10 @@ class SXFlasher():
         else:
             self.sud.check_signature_cmd()
             
-        self.sud.set_write_chunk_size(self.write_chunk_size)
+        if self.write_chunk_size < 0:
+            self.sud.tune_write_chunk_size(self.product, force = self.retune)
+        else:
+            self.sud.set_write_chunk_size(self.write_chunk_size)
         
     def init_vars(self):
         sud = self.sud
@@ -54,37 +179,12 @@ class SXFlasher():
             self.def_security = 'OFF'
             return
 
-        self.max_download_size = int(sud.getvar('max-download-size'))
-        self.sector_size = sud.getvar('Sector-size', 'int')
-        self.product = sud.getvar('product')
-        self.version = sud.getvar('version')
-        self.blver = sud.getvar('version-bootloader')
-        self.bbver = sud.getvar('version-baseband')
-        self.serialno = sud.getvar('serialno')
-        self.secure = sud.getvar('secure')
-        self.loader_ver = sud.getvar('Loader-version')
-        self.phone_id = sud.getvar('Phone-id')
-        self.device_id = sud.getvar('Device-id')
-        self.platform_id = sud.getvar('Platform-id')
-        self.rooting_status = sud.getvar('Rooting-status')
-        self.ufs_info = sud.getvar('Ufs-info')
-        self.emmc_info = sud.getvar('Emmc-info')
-        self.def_security = sud.getvar('Default-security')
-        self.keystore_counter = sud.getvar('Keystore-counter', 'int')
-        self.security_state = sud.getvar('Security-state')
-
-        sud.getvar('Stored-security-state')
-        sud.getvar('Keystore-xcs')
-
-        self.s1_root = sud.getvar('S1-root')
-        self.sake_root = sud.getvar('Sake-root')
-        self.root_key_hash = sud.command('Get-root-key-hash')   # PLF_ROOT_HASH
-        self.slot_count = sud.getvar('slot-count', 'int')
-        self.current_slot = sud.getvar('current-slot')
-        self.battery_level = sud.getvar('Battery', 'int')
-        sud.getvar('Frp-partition')
-        sud.getvar('X-conf')
-        sud.getvar('Soc-unique-id')
+        self.devinfo = info = sud.get_device_info()
+        for name in [ 'max_download_size', 'sector_size', 'product', 'version', 'blver', 'bbver', 'serialno',
+                      'secure', 'loader_ver', 'phone_id', 'device_id', 'platform_id', 'rooting_status',
+                      'ufs_info', 'emmc_info', 'def_security', 'keystore_counter', 'security_state',
+                      's1_root', 'sake_root', 'root_key_hash', 'slot_count', 'current_slot', 'battery_level' ]:
+            setattr(self, name, getattr(info, name))
         
         self.flash_booth_slots = False
         if self.slot_count is not None:
@@ -137,6 +237,26 @@ class SXFlasher():
             
         return self.change_flashmode(False)
         
+    def get_fwcache(self):
+        if not self.use_fwcache or not self.wdir:
+            return None
+        if self.fwcache is None or self.fwcache.wdir != self.wdir:
+            self.fwcache = sinfile.ManifestCache(self.wdir)
+        return self.fwcache
+
+    def get_hotcache(self):
+        if not self.use_hotcache or not self.wdir:
+            return None
+        if self.hotcache is None or self.hotcache.wdir != self.wdir:
+            self.hotcache = sinfile.HotCache(self.wdir)
+            if self.hotcache.load():
+                log.info(f'Using hot cache "{self.hotcache.filename}"')
+        return self.hotcache
+
+    def save_fwcache(self):
+        if self.fwcache:
+            self.fwcache.save()
+
     def get_partition_list(self, source = 'xml'):
         pdir = self.wdir + os.path.sep + 'partition'
         if not os.path.exists(pdir):
@@ -157,6 +277,23 @@ class SXFlasher():
             log.warn(f'File "{deliv}" not found!')
             return [ ]
 
+        fwcache = self.get_fwcache()
+        flist = fwcache.get(deliv, 'partition_delivery') if fwcache else None
+        if flist is None:
+            flist = self.parse_partition_delivery(deliv)
+            if fwcache:
+                fwcache.set(deliv, 'partition_delivery', flist)
+
+        images = [ ]
+        for file_path in flist:
+            fname = pdir + os.path.sep + file_path
+            if not os.path.exists(fname):
+                raise RuntimeError(f'File "{fname}" not found!')
+            images.append( fname )
+        
+        return images
+
+    def parse_partition_delivery(self, deliv):
         tree = ET.parse(deliv)
         root = tree.getroot()
         if root.tag != 'PARTITION_DELIVERY':
@@ -166,19 +303,16 @@ class SXFlasher():
         if fmt != '1':
             raise RuntimeError(f'Incorrect XML format = "{fmt}", expected "1"')
 
-        images = [ ]
+        flist = [ ]
         for child in root:
             if child.tag == 'PARTITION_IMAGES':
                 for file in child:
                     if file.tag == 'FILE':
                         file_path = file.attrib['PATH']
                         if len(file_path) > 1:
-                            fname = pdir + os.path.sep + file_path
-                            if not os.path.exists(fname):
-                                raise RuntimeError(f'File "{fname}" not found!')
-                            images.append( fname )
+                            flist.append( file_path )
         
-        return images
+        return flist
     
     def get_boot_delivery(self):
         bootdir = self.wdir + os.path.sep + 'boot'
@@ -189,6 +323,15 @@ class SXFlasher():
         if not os.path.exists(deliv):
             raise RuntimeError(f'File "{deliv}" not found!')
 
+        fwcache = self.get_fwcache()
+        bd = fwcache.get(deliv, 'boot_delivery') if fwcache else None
+        if bd is None:
+            bd = self.parse_boot_delivery(deliv)
+            if fwcache:
+                fwcache.set(deliv, 'boot_delivery', bd)
+        return bd
+
+    def parse_boot_delivery(self, deliv):
         tree = ET.parse(deliv)
         root = tree.getroot()
         if root.tag != 'BOOT_DELIVERY':
@@ -251,21 +394,42 @@ class SXFlasher():
             
         return bd
     
-    def check_in_updatexml(self, fname):
+    def get_updatexml_index(self):
         xmlfn = self.wdir + os.path.sep + 'update.xml'
         if not osp.exists(xmlfn):
             raise RuntimeError(f'File "{xmlfn}" not found!')
         
+        st = os.stat(xmlfn)
+        if self.updatexml:
+            fn, size, mtime, index = self.updatexml
+            if fn == xmlfn and size == st.st_size and mtime == st.st_mtime_ns:
+                return index
+
+        fwcache = self.get_fwcache()
+        index = fwcache.get(xmlfn, 'update_index') if fwcache else None
+        if index is None:
+            index = self.parse_updatexml(xmlfn)
+            if fwcache:
+                fwcache.set(xmlfn, 'update_index', index)
+
+        self.updatexml = (xmlfn, st.st_size, st.st_mtime_ns, index)
+        return index
+
+    def parse_updatexml(self, xmlfn):
         tree = ET.parse(xmlfn)
         root = tree.getroot()
         if root.tag != 'UPDATE':
             raise RuntimeError(f'Incorrect XML root name "{root.tag}", expected "UPDATE"')
         
+        index = { }
         for child in root:
-            if child.text == fname:
-                return child.tag
+            if child.text is not None and child.text not in index:
+                index[child.text] = child.tag
                 
-        return None
+        return index
+
+    def check_in_updatexml(self, fname):
+        return self.get_updatexml_index().get(fname)
     
     def process_partition(self, plst):
         sud = self.sud
@@ -330,7 +494,31 @@ class SXFlasher():
             return False
         return True
     
+    def get_sin_info(self, fn):
+        if fn in self.manifest:
+            return self.manifest[fn]
+        fwcache = self.get_fwcache()
+        return fwcache.get(fn, 'scan') if fwcache else None
+
     def get_imgname_by_sin(self, fn):
+        if fn in self.manifest:
+            return self.manifest[fn]['imgname']
+
+        fwcache = self.get_fwcache()
+        if fwcache:
+            info = fwcache.get(fn, 'scan')
+            if info:
+                return info['imgname']
+            imgname = fwcache.get(fn, 'imgname')
+            if imgname is None:
+                imgname = self.read_imgname_by_sin(fn)
+                if imgname:
+                    fwcache.set(fn, 'imgname', imgname)
+            return imgname
+
+        return self.read_imgname_by_sin(fn)
+
+    def read_imgname_by_sin(self, fn):
         fsz = osp.getsize(fn)
         if fsz < 64:
             return None       
@@ -368,6 +556,31 @@ class SXFlasher():
         return osp.splitext(first_filename)[0]
     
     def process_sin(self, filename, aux_cmd = 'flash'):
+        return self.process_file(f'{aux_cmd}:{self.current_slot}', self._process_sin, filename, aux_cmd)
+
+    def process_ta(self, filename, max_units = None):
+        return self.process_file('ta', self._process_ta, filename, max_units)
+
+    def process_file(self, kind, func, filename, *args):
+        fn = osp.relpath(filename, self.wdir) if osp.sep in filename else filename
+        start = self.timeline.now()
+        step = f'{kind}:{fn}'
+        if self.journal and self.journal.is_done(step):
+            log.info(f'Skip "{fn}"! Reason: completed in previous session')
+            self.timeline.add_file(fn, start, 0, 'skip')
+            return
+        upsize = self.sud.stats.uploads['bytes']
+        status = 'fail'
+        try:
+            res = func(filename, *args)
+            status = 'ok'
+            if self.journal and res is not False:
+                self.journal.done(step)
+            return res
+        finally:
+            self.timeline.add_file(fn, start, self.sud.stats.uploads['bytes'] - upsize, status)
+
+    def _process_sin(self, filename, aux_cmd = 'flash'):
         sud = self.sud
         has_slot = False
         if osp.sep not in filename:
@@ -375,54 +588,39 @@ class SXFlasher():
         
         sinfn = osp.basename(filename)
         sinsize = osp.getsize(filename)
+        self.progress(osp.relpath(filename, self.wdir))
         
         ret = self.check_in_updatexml(sinfn)
         log.debug(f'check_in_updatexml("{sinfn}") => "{ret}"')
         if ret and ret == 'NOERASE':
             if not self.erase_user_data:
                 log.debug(f'  Skip SIN-file "{sinfn}". Reason: update.xml = "{ret}" and erase_user_data is False')
-                return
+                return False
 
         if sinsize < 512:
             raise RuntimeError(f'Incorrect SIN-file size: {sinsize} bytes')
 
-        with tarfile.open(filename) as tar: 
+        hotcache = self.get_hotcache()
+        mapped = hotcache.get_sin(filename) if hotcache else None
+        info = self.get_sin_info(filename) if self.chunk_cache else None
+        with sinfile.SinReader(filename, self.max_download_size, sud.upload_window_size, info = info, chunk_cache = self.chunk_cache, mapped = mapped) as reader:
             log.debug(f'Unpacking file "{sinfn}" ... ')
             imgname = None
-            num = -2    
-            for member in tar:
-                if member.type != tarfile.REGTYPE:
-                    continue  # process only regular files
-                
-                fn = member.name
-                stream = tar.extractfile(member)
-                if stream is None:  # process only regular files
-                    continue
-                
+            for chunk in reader:  # next chunk decompressed in background thread
+                fn = chunk.name
+                num = chunk.num
                 cname = f'{sinfn}/{fn}'
                 if sinsize > 50*1000*1000:
                     log.debug(f'process sin chunk: "{cname}" ...')
                 
-                data = stream.read()
-                if len(data) >= self.max_download_size:
-                    raise RuntimeError(f'Chunk "{cname}" very large! Size = {len(data)}, max = {self.max_download_size}')
-
-                if len(data) == 0:
-                    raise RuntimeError(f'Chunk "{cname}" is empty! Size = {len(data)}')
-
+                dsize = chunk.size
                 if self.test >= 100:
-                    log.info(f'  Skip sin chunk "{cname}", size: {len(data)} ! Reason: test = {self.test}')
+                    log.info(f'  Skip sin chunk "{cname}", size: {dsize} ! Reason: test = {self.test}')
                     continue
 
-                num += 1
                 if num == -1:  # CMS
-                    imgname = osp.splitext(fn)[0]
-                    if not fn.endswith('.cms'):
-                        raise RuntimeError(f'File "{cname}" contain incorrect CMS (ext)')
-                    
-                    if data[0:2] != b'\x30\x82':
-                        raise RuntimeError(f'File "{cname}" contain incorrect CMS (magic)')
-                    
+                    data = chunk.data
+                    imgname = reader.imgname
                     log.info(f'Uploading signature "{cname}" (size:{len(data)})')
                     ret = sud.upload(data, sign = sud.cmd_sign_with_data_allow)
                     if not ret:
@@ -436,11 +634,11 @@ class SXFlasher():
                     log.info('  Signature: OKAY')
                     continue  # CMS file processed
                 
-                if osp.splitext(fn)[0] != imgname:
-                    raise RuntimeError(f'File "{sinfn}" contain incorrect filename: "{fn}", expected: "{imgname}"')
-                
-                log.info(f'Uploading chunk "{cname}" (size:{len(data)})')
-                ret = sud.upload(data)
+                log.info(f'Uploading chunk "{cname}" (size:{dsize})')
+                if chunk.view is not None:
+                    ret = sud.upload(chunk.view)  # zero-copy upload of mapped chunk
+                else:
+                    ret = sud.upload(chunk, size = dsize)
 
                 #if self.test:
                 #    sud.upload(b'')  # erase xboot download buffer
@@ -501,10 +699,11 @@ class SXFlasher():
                         if ret is None:
                             raise RuntimeError(f'Cannot {aux_cmd} image: "{imgname}". Error: {sud.lastresp}')
 
-    def process_ta(self, filename, max_units = None):
+    def _process_ta(self, filename, max_units = None):
         sud = self.sud
         tafn = osp.basename(filename)
         tasize = osp.getsize(filename)
+        self.progress(osp.relpath(filename, self.wdir))
         log.info(f'Process TA-file "{tafn}" ...')
         taulist = ta.load_from_file(filename)
         if not taulist:
@@ -514,6 +713,7 @@ class SXFlasher():
             if len(taulist) > max_units:
                 raise RuntimeError(f'Incorrect ta-file "{tafn}"! Too many units. Expected <= {max_units}')
             
+        wlist = [ ]
         for tau in taulist:
             if tau.part == 2:
                 if tau.code in [ 2003,    # hw config
@@ -525,6 +725,15 @@ class SXFlasher():
                     ]:
                     log.debug(f'  Skip TA unit from "{tafn}". Reason: unit [2:{tau.code}] are special!')
                     continue
+            wlist.append(tau)
+
+        if self.ta_diff and self.test < 100:
+            if self.test:
+                log.info(f'  Skip writing of "{tafn}"! Reason: test = {self.test}')
+            sud.write_ta_diff(wlist, test = bool(self.test))
+            return
+
+        for tau in wlist:
             cmd = f'Write-TA:{tau.part}:{tau.code}'
             log.info(f'CMD: {cmd}   <size = {len(tau.value)}>')
             if self.test:
@@ -535,16 +744,183 @@ class SXFlasher():
                     raise RuntimeError(f'Cannot {cmd} ! Error: {str(sud.lastresp)}')
     
 
+    def get_flash_files(self):
+        # returns list of all SIN/TA files of firmware, list of boot images and missing files
+        wdir = self.wdir
+        files = [ ]
+        pdir = wdir + osp.sep + 'partition'
+        if os.path.exists(pdir):
+            plst = self.get_partition_list('xml')
+            if not plst:
+                plst = self.get_partition_list('dir')
+            if not plst:
+                raise RuntimeError(f'Partition SINs not founded!')
+            files += plst
+
+        for fn in sorted(os.listdir(wdir)):
+            filename = wdir + osp.sep + fn
+            if fn.endswith('.ta'):
+                files.append(filename)
+            if fn.endswith('.sin') and 'partition' not in fn.lower() and 'persist' not in fn.lower():
+                files.append(filename)
+
+        errors = { }
+        bootdir = wdir + osp.sep + 'boot'
+        boot_images = [ ]
+        bd = self.get_boot_delivery()
+        for conf in bd['configs'].values():
+            for fn in conf['boot_images'] + conf['boot_config']:
+                filename = bootdir + osp.sep + fn
+                if filename in files:
+                    continue
+                if not osp.isfile(filename):
+                    errors[filename] = 'File not found!'
+                    continue
+                files.append(filename)
+                if fn in conf['boot_images']:
+                    boot_images.append(filename)
+
+        return files, boot_images, errors
+
+    def prepare(self):
+        hotcache = sinfile.HotCache(self.wdir)
+        files, boot_images, errors = self.get_flash_files()
+        for fn, err in errors.items():
+            log.error(f'Prepare: "{osp.relpath(fn, self.wdir)}": {err}')
+        if errors:
+            raise RuntimeError(f'Cannot prepare hot cache! Incorrect files: {len(errors)}')
+        return hotcache.prepare([ fn for fn in files if fn.endswith('.sin') ])
+
+    def preflight(self):
+        wdir = self.wdir
+        log.info(f'Pre-flight check of firmware directory ...')
+        self.check_in_updatexml('')  # check existance of update.xml
+        files, boot_images, errors = self.get_flash_files()
+
+        manifest = { }
+        fwcache = self.get_fwcache()
+        if fwcache:
+            for fn in files:
+                info = fwcache.get(fn, 'scan')
+                if info:
+                    manifest[fn] = info
+        
+        scanlist = [ fn for fn in files if fn not in manifest ]
+        if manifest:
+            log.debug(f'Pre-flight: {len(manifest)} files found in manifest cache')
+        
+        res, err = sinfile.scan_files(scanlist, self.preflight_workers)
+        errors.update(err)
+        for fn, info in res.items():
+            manifest[fn] = info
+            if fwcache:
+                fwcache.set(fn, 'scan', info)
+        for fn in boot_images:
+            if fn in manifest and manifest[fn]['imgname'] != 'bootloader':
+                errors[fn] = f'Incorrect SIN image name: "{manifest[fn]["imgname"]}"'
+
+        for fn, err in errors.items():
+            log.error(f'Pre-flight: "{osp.relpath(fn, wdir)}": {err}')
+
+        if errors:
+            raise RuntimeError(f'Pre-flight check failed! Incorrect files: {len(errors)}')
+
+        log.info(f'Pre-flight check: {len(manifest)} files OK')
+        self.manifest = manifest
+        return manifest
+
+    def get_fw_hash(self):
+        # identity of firmware: names, sizes and mtimes of all flashed files
+        files, boot_images, errors = self.get_flash_files()
+        sha = hashlib.sha1()
+        for fn in sorted(files + [ osp.join(self.wdir, 'update.xml') ]):
+            try:
+                st = os.stat(fn)
+            except OSError:
+                continue
+            sha.update(f'{osp.relpath(fn, self.wdir)}|{st.st_size}|{st.st_mtime_ns}\n'.encode('utf-8'))
+        return sha.hexdigest()
+
+    def init_journal(self):
+        self.journal = None
+        if self.test or not self.serialno:
+            return None
+        journal = FlashJournal(self.wdir, self.serialno, self.get_fw_hash())
+        if self.resume:
+            if journal.load():
+                log.info(f'Resume mode: {len(journal.steps)} steps completed in previous session')
+            else:
+                log.info(f'Resume mode: journal of previous session not found')
+        journal.save()
+        self.journal = journal
+        return journal
+
+    def dump_stats(self):
+        filename = logcfg.get_log_filename(f'{self.log_suffix}__stats', '.json')
+        try:
+            os.makedirs(osp.dirname(filename), exist_ok = True)
+            self.sud.stats.dump(filename)
+            log.debug(f'USB stats saved to "{filename}"')
+            up = self.sud.stats.as_dict()['uploads']
+            if up['mbps']:
+                log.info(f'Uploaded {up["bytes"]} bytes: {up["mbps"]:.1f} MB/s (ACK wait: {up["ack_time"]:.1f} sec)')
+        except Exception as e:
+            log.warn(f'Cannot save USB stats: {e}')
+
+    def dump_timeline(self, status, error = None):
+        filename = logcfg.get_log_filename(f'{self.log_suffix}__timeline', '.json')
+        res = self.timeline.as_dict()
+        res['status'] = status
+        res['error'] = error
+        res['test'] = self.test
+        res['wdir'] = self.wdir
+        res['product'] = getattr(self, 'product', None)
+        res['serialno'] = getattr(self, 'serialno', None)
+        try:
+            os.makedirs(osp.dirname(filename), exist_ok = True)
+            with open(filename, 'w', encoding = 'utf-8') as file:
+                json.dump(res, file, indent = 4)
+            log.debug(f'Session timeline saved to "{filename}"')
+        except Exception as e:
+            log.warn(f'Cannot save session timeline: {e}')
+
     def flash_stock(self, wdir):
+        self.sud.stats.reset()
+        self.timeline.reset()
+        status = 'fail'
+        error = None
+        try:
+            res = self._flash_stock(wdir)
+            status = 'ok'
+            return res
+        except BaseException as e:
+            error = str(e) or type(e).__name__
+            raise
+        finally:
+            self.timeline.end(status)
+            self.dump_timeline(status, error)
+            self.dump_stats()
+
+    def _flash_stock(self, wdir):
         self.wdir = wdir
         sud = self.sud
         
+        if self.preflight_check:
+            self.phase('preflight')
+            try:
+                self.preflight()
+            finally:
+                self.save_fwcache()
+
+        self.phase('connect')
         self.connect()
         self.check_battery()
+        self.init_journal()
         
         log.info(f'Firmware directory: "{wdir}"')
         log.info(f'test = {self.test}')
         
+        self.phase('flashmode')
         self.activate_flashmode()
 
         if not self.test:
@@ -553,6 +929,7 @@ class SXFlasher():
                 log.error(f'Cannot get Error log: {sud.lastresp}')
 
         # ------------ Repartition ----------------------------------------
+        self.phase('repartition')
         pdir = self.wdir + os.path.sep + 'partition'
         if not os.path.exists(pdir):
             log.warn(f'Directory "{pdir}" not found!')
@@ -566,6 +943,7 @@ class SXFlasher():
             self.process_partition(plst)
 
         # ------------ sin-files ----------------------------------------
+        self.phase('sin')
         for fn in os.listdir(self.wdir): 
             filename = self.wdir + osp.sep + fn
                 
@@ -602,6 +980,7 @@ class SXFlasher():
             self.process_sin(filename)
         
         # ------------ ta-files ----------------------------------------
+        self.phase('ta')
         for fn in os.listdir(self.wdir): 
             filename = self.wdir + osp.sep + fn
             if fn.endswith('.ta'):
@@ -616,6 +995,7 @@ class SXFlasher():
                 self.process_ta(filename, max_units = 1)
         
         # ------------ xboot image ----------------------------------------
+        self.phase('boot')
         bd = self.get_boot_delivery()
         #print(json.dumps(bd, indent = 4))
         
@@ -675,8 +1055,10 @@ class SXFlasher():
             raise RuntimeError(f'Incorrect SIN image name: "{imgname}"')
         
         self.process_sin(boot_sin_filename)
+        self.save_fwcache()
         
         # ------------ xboot log ----------------------------------------
+        self.phase('logs')
         if self.test < 100:
             txt = sud.dump_err_log()
             if txt is None:
@@ -695,15 +1077,18 @@ class SXFlasher():
                 log.debug('Firmware history log: \n' + txt.decode('latin-1'))
         
         # ------------ set slot active ----------------------------------
+        self.phase('set_active')
         if not self.test and self.current_slot is not None:
             slot = sud.set_current_slot(self.current_slot)
             if slot:
                 log.info(f'Set slot "{slot}" active')
         
         # ------------ get out of flash mode ----------------------------
+        self.phase('flashmode_off')
         self.deactivate_flashmode()
         
         # ------------ Sync -----------------------------------------
+        self.phase('sync')
         log.info(f'Sent command: "Sync" ...')
         if self.test:
             log.info(f'  Skip "Sync" command! Reason: test = {self.test}')
@@ -719,7 +1104,11 @@ class SXFlasher():
             log.info(f'Command "Sync" completed!')
         
         # ------------ finish -----------------------------------------
+        self.phase('finish')
         log.info(f'======= Flashing completed ======= test: {self.test}')
+        if self.journal:
+            self.journal.remove()
+            self.journal = None
         if not self.test:
             txt = sud.dump_err_log()
 
@@ -735,7 +1124,19 @@ if __name__ == '__main__':
     parser.add_option("-S", "--sync", dest = "sync_timeout", default = 60, type = "int")
     parser.add_option("-L", "--loglevel", dest = "loglevel", default = 0, type = "int")
     parser.add_option("-e", "--eud", dest = "erase_user_data", action="store_true", default = False)
-    parser.add_option("-w", "--wcs", dest = "write_chunk_size", default = 0, type = "int")
+    parser.add_option("-w", "--wcs", dest = "write_chunk_size", default = 0, type = "int")  # -1 = auto
+    parser.add_option("", "--retune", dest = "retune", action="store_true", default = False)
+    parser.add_option("", "--skip-preflight", dest = "skip_preflight", action="store_true", default = False)
+    parser.add_option("", "--no-cache", dest = "no_cache", action="store_true", default = False)
+    parser.add_option("", "--usb-path", dest = "usb_path", default = None, type = "string")
+    parser.add_option("", "--serial", dest = "serial", default = None, type = "string")
+    parser.add_option("", "--prepare", dest = "prepare", action="store_true", default = False)
+    parser.add_option("", "--no-hotcache", dest = "no_hotcache", action="store_true", default = False)
+    parser.add_option("", "--chunk-cache", dest = "chunk_cache", default = 0, type = "int")  # size in MiB
+    parser.add_option("", "--ta-full", dest = "ta_full", action="store_true", default = False)  # write all TA units
+    parser.add_option("-r", "--resume", dest = "resume", action="store_true", default = False)
+    parser.add_option("", "--emu", dest = "emu", action="store_true", default = False)  # use emulated device
+    parser.add_option("", "--emu-bw", dest = "emu_bw", default = 40, type = "int")  # emulated link bandwidth in MB/s
     (opt, args) = parser.parse_args() 
     
     if not opt.dir:
@@ -766,6 +1167,26 @@ if __name__ == '__main__':
         sxf.erase_user_data = opt.erase_user_data
         sxf.sync_timeout = opt.sync_timeout
         sxf.write_chunk_size = opt.write_chunk_size
+        sxf.retune = opt.retune
+        sxf.preflight_check = not opt.skip_preflight
+        sxf.use_fwcache = not opt.no_cache
+        sxf.sud.dev_path = opt.usb_path
+        sxf.sud.dev_serial = opt.serial
+        sxf.use_hotcache = not opt.no_hotcache
+        sxf.resume = opt.resume
+        sxf.ta_diff = not opt.ta_full
+        if opt.emu:
+            import sxemu
+            sxf.sud.usb_backend = sxemu.get_backend()
+            for dev in sxf.sud.usb_backend.devices:
+                dev.bandwidth = opt.emu_bw * 1000*1000
+        if opt.prepare:
+            sxf.wdir = opt.dir
+            sxf.prepare()
+            exit(0)
+
+        if opt.chunk_cache > 0:
+            sxf.chunk_cache = sinfile.ChunkCache(opt.chunk_cache * 1024*1024)
         
         sxf.flash_stock(opt.dir)
     
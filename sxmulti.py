@@ -0,0 +1,192 @@
+import os
+import sys
+import time
+import queue
+from os import path as osp
+
+import logging
+import logcfg
+from logcfg import log
+
+import somcusb
+import sxflasher
+import sinfile
+
+
+def get_dev_tag(path):
+    return path.replace('-', '_').replace('.', '_')
+
+def flash_device(dev_path, wdir, opt, pqueue):
+    # worker process: flash one device
+    tag = get_dev_tag(dev_path)
+    log_file = logcfg.get_log_filename(f'__{tag}')
+    logcfg.redirect_to_file(log_file)
+    log.debug(f'====================== sxflasher [{dev_path}] =========================')
+
+    res = { 'path': dev_path, 'serialno': None, 'status': 'FAIL', 'error': None, 'time': None, 'log': log_file }
+    progress = lambda stage: pqueue.put( (dev_path, stage) )
+    t0 = time.monotonic()
+    sxf = None
+    try:
+        sxf = sxflasher.SXFlasher(loglevel = opt['loglevel'])
+        sxf.test = opt['test']
+        sxf.sud.dev_path = dev_path
+        sxf.sud.read_timeout = opt['read_timeout']
+        sxf.sud.write_timeout = opt['write_timeout']
+        sxf.erase_user_data = opt['erase_user_data']
+        sxf.sync_timeout = opt['sync_timeout']
+        sxf.write_chunk_size = opt['write_chunk_size']
+        sxf.preflight_check = False   # checked by orchestrator
+        sxf.resume = opt['resume']
+        sxf.progress_callback = progress
+        sxf.log_suffix = f'__{tag}'
+        if opt['chunk_cache'] > 0:
+            sxf.chunk_cache = sinfile.ChunkCache(opt['chunk_cache'] * 1024*1024)
+        sxf.flash_stock(wdir)
+        res['status'] = 'OK'
+    except Exception as e:
+        log.exception('CRITICAL ERROR')
+        res['error'] = str(e)
+        if sxf and sxf.flashmode:
+            try:
+                sxf.deactivate_flashmode(fin = True)
+            except Exception:
+                log.exception('Cannot deactivate flash mode')
+
+    if sxf:
+        res['serialno'] = getattr(sxf, 'serialno', None)
+    res['time'] = time.monotonic() - t0
+    progress(res['status'])
+    return res
+
+
+class MultiFlasher():
+    def __init__(self, loglevel = logging.CRITICAL):
+        self.loglevel = loglevel
+        self.max_workers = None  # None = number of devices
+        self.status_interval = 2.0
+        self.opt = { }
+
+    def list_devices(self):
+        sud = somcusb.SomcUsbDevice(loglevel = self.loglevel)
+        return sud.list_devices()
+
+    def print_table(self, rows, header):
+        widths = [ max([ len(str(row[i])) for row in rows + [ header ] ]) for i in range(len(header)) ]
+        fmt = '  '.join([ f'{{:<{w}}}' for w in widths ])
+        log.info(fmt.format(*header))
+        for row in rows:
+            log.info(fmt.format(*[ str(x) for x in row ]))
+
+    def print_progress(self, state):
+        rows = [ [ path, st['steps'], st['stage'], f'{time.monotonic() - st["start"]:.0f}s' ] for path, st in state.items() ]
+        self.print_table(rows, [ 'DEVICE', 'STEPS', 'STAGE', 'TIME' ])
+
+    def print_results(self, results):
+        rows = [ ]
+        for res in results:
+            rows.append( [ res['path'], res['serialno'] or '', res['status'], f'{res["time"]:.1f}s', res['error'] or '', osp.basename(res['log']) ] )
+        self.print_table(rows, [ 'DEVICE', 'SERIAL', 'STATUS', 'TIME', 'ERROR', 'LOG' ])
+
+    def flash_stock(self, wdir, devices = None):
+        if not devices:
+            devices = [ dev['path'] for dev in self.list_devices() ]
+        if not devices:
+            raise RuntimeError("SOMC usb devices not found!")
+
+        log.info(f'Devices: {", ".join(devices)}')
+        sxf = sxflasher.SXFlasher(loglevel = self.loglevel)
+        sxf.wdir = wdir
+        try:
+            sxf.preflight()
+        finally:
+            sxf.save_fwcache()
+
+        import multiprocessing
+        import concurrent.futures
+        workers = self.max_workers or len(devices)
+        state = { path: { 'stage': 'wait', 'steps': 0, 'start': time.monotonic() } for path in devices }
+        results = [ ]
+        with multiprocessing.Manager() as manager:
+            pqueue = manager.Queue()
+            with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as pool:
+                futures = { pool.submit(flash_device, path, wdir, self.opt, pqueue): path for path in devices }
+                pending = set(futures.keys())
+                last_print = 0
+                while pending:
+                    done, pending = concurrent.futures.wait(pending, timeout = 0.2)
+                    for fut in done:
+                        path = futures[fut]
+                        try:
+                            results.append(fut.result())
+                        except Exception as e:  # worker process crashed
+                            results.append( { 'path': path, 'serialno': None, 'status': 'FAIL', 'error': str(e), 'time': 0, 'log': '' } )
+                    while True:
+                        try:
+                            path, stage = pqueue.get_nowait()
+                        except queue.Empty:
+                            break
+                        st = state[path]
+                        if st['stage'] == 'wait':
+                            st['start'] = time.monotonic()
+                        st['stage'] = stage
+                        st['steps'] += 1
+                    if time.monotonic() - last_print >= self.status_interval:
+                        self.print_progress(state)
+                        last_print = time.monotonic()
+
+        results.sort(key = lambda res: devices.index(res['path']))
+        self.print_results(results)
+        failed = [ res for res in results if res['status'] != 'OK' ]
+        log.info(f'Devices flashed: {len(results) - len(failed)} OK, {len(failed)} FAIL')
+        return results
+
+
+if __name__ == '__main__':
+    import optparse
+    parser = optparse.OptionParser("usage: %prog [options]", add_help_option = False)
+    parser.add_option("-d", "--dir", dest = "dir", default = "", type = "string")
+    parser.add_option("-t", "--test", dest = "test", default = 1, type = "int")
+    parser.add_option("", "--rt", dest = "read_timeout",  default = 6, type = "int")
+    parser.add_option("", "--wt", dest = "write_timeout", default = 6, type = "int")
+    parser.add_option("-S", "--sync", dest = "sync_timeout", default = 60, type = "int")
+    parser.add_option("-L", "--loglevel", dest = "loglevel", default = 0, type = "int")
+    parser.add_option("-e", "--eud", dest = "erase_user_data", action="store_true", default = False)
+    parser.add_option("-w", "--wcs", dest = "write_chunk_size", default = 0, type = "int")  # -1 = auto
+    parser.add_option("-D", "--devices", dest = "devices", default = "", type = "string")  # comma separated USB paths
+    parser.add_option("-r", "--resume", dest = "resume", action="store_true", default = False)
+    parser.add_option("-j", "--jobs", dest = "jobs", default = 0, type = "int")
+    parser.add_option("", "--chunk-cache", dest = "chunk_cache", default = 0, type = "int")  # size in MiB (0 = disabled)
+    parser.add_option("-l", "--list", dest = "list", action="store_true", default = False)
+    (opt, args) = parser.parse_args()
+
+    log.set_level(opt.loglevel if opt.loglevel else logging.INFO)
+    mf = MultiFlasher(loglevel = opt.loglevel)
+    if opt.list:
+        for dev in mf.list_devices():
+            log.info(f'{dev["path"]}  serial: {dev["serial"]}')
+        exit(0)
+
+    if not opt.dir:
+        log.error(f'Working directory not specified')
+        exit(1)
+
+    if not osp.isdir(opt.dir):
+        log.error(f'Working directory "{opt.dir}" not found')
+        exit(1)
+
+    mf.max_workers = opt.jobs if opt.jobs > 0 else None
+    mf.opt = {
+        'test': opt.test,
+        'loglevel': opt.loglevel,
+        'read_timeout': opt.read_timeout if opt.read_timeout >= 100 else opt.read_timeout * 1000,
+        'write_timeout': opt.write_timeout if opt.write_timeout >= 100 else opt.write_timeout * 1000,
+        'erase_user_data': opt.erase_user_data,
+        'sync_timeout': opt.sync_timeout,
+        'write_chunk_size': opt.write_chunk_size,
+        'chunk_cache': opt.chunk_cache,
+        'resume': opt.resume,
+    }
+    devices = [ path.strip() for path in opt.devices.split(',') if path.strip() ]
+    results = mf.flash_stock(opt.dir, devices)
+    exit(0 if all([ res['status'] == 'OK' for res in results ]) else 2)
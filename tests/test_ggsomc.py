@@ -0,0 +1,144 @@
+import os
+import sys
+import array
+import ctypes
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ggsomc
+from ggsomc import FALSE, TRUE, INFINITE, ERROR_IO_PENDING, WAIT_OBJECT_0, WAIT_TIMEOUT
+from pyusb.core import USBError, USBTimeoutError
+
+
+class FakeLib():
+    # kernel32 substitute: overlapped WriteFile requests are completed by WaitForSingleObject
+    def __init__(self, short = None, timeout = None):
+        self.short = dict(short or { })      # request num => number of bytes reported as written
+        self.timeout = set(timeout or ( ))   # request nums => WAIT_TIMEOUT on finite wait
+        self.next_event = 100
+        self.requests = [ ]      # [ num, event, data, state ]; state: 'pending', 'done', 'cancelled'
+        self.waits = [ ]         # (num, timeout)
+        self.cancel_count = 0
+        self.max_inflight = 0
+        self.errors = [ ]
+
+    def _find(self, event):
+        for req in reversed(self.requests):
+            if req[1] == event:
+                return req
+        raise AssertionError(f'Unknown event {event}')
+
+    def inflight(self):
+        return [ req for req in self.requests if req[3] == 'pending' ]
+
+    def CreateEventA(self, attr, manual, state, name):
+        self.next_event += 1
+        return self.next_event
+
+    def ResetEvent(self, event):
+        return TRUE
+
+    def CloseHandle(self, handle):
+        return TRUE
+
+    def GetLastError(self):
+        return ERROR_IO_PENDING
+
+    def WriteFile(self, hdev, addr, size, written, povl):
+        event = povl._obj.hEvent
+        if any(req[1] == event for req in self.inflight()):
+            self.errors.append(f'OVERLAPPED of event {event} reused while pending')
+        self.requests.append( [ len(self.requests), event, ctypes.string_at(addr.value, size), 'pending' ] )
+        self.max_inflight = max(self.max_inflight, len(self.inflight()))
+        return FALSE
+
+    def WaitForSingleObject(self, event, timeout):
+        req = self._find(event)
+        self.waits.append( (req[0], timeout) )
+        if req[3] == 'pending':
+            if timeout != INFINITE and req[0] in self.timeout:
+                return WAIT_TIMEOUT
+            req[3] = 'done'
+        return WAIT_OBJECT_0
+
+    def GetOverlappedResult(self, hdev, povl, pbytes, wait):
+        req = self._find(povl._obj.hEvent)
+        pbytes._obj.value = self.short.get(req[0], len(req[2]))
+        return TRUE
+
+    def CancelIo(self, hdev):
+        self.cancel_count += 1
+        for req in self.inflight():
+            req[3] = 'cancelled'
+        return TRUE
+
+
+class _Dev():
+    path = '\\\\?\\usb#vid_0fce&pid_adde#0123456789#{guid}'
+
+
+class _DeviceHandle(ggsomc._DeviceHandle):
+    def __del__(self):
+        pass  # handles are closed explicitly while FakeLib is installed
+
+
+class BulkWriteAsyncTest(unittest.TestCase):
+    def write(self, lib, size, transfer_size = 4, num_transfers = 3):
+        with mock.patch.object(ggsomc, '_lib', lib):
+            backend = ggsomc._GordonGateUsb(lib, None)
+            handle = _DeviceHandle(_Dev(), 1)
+            data = array.array('B', bytes(range(size)))
+            try:
+                return backend.bulk_write_async(handle, 0x01, 0, data, 1000, transfer_size, num_transfers), data
+            finally:
+                ggsomc._DeviceHandle.__del__(handle)
+
+    def test_completion_order(self):
+        lib = FakeLib()
+        size, data = self.write(lib, 30)
+        self.assertEqual(size, 30)
+        self.assertEqual(b''.join(req[2] for req in lib.requests), data.tobytes())
+        self.assertEqual([ len(req[2]) for req in lib.requests ], [ 4 ] * 7 + [ 2 ])
+        self.assertEqual([ num for num, timeout in lib.waits ], list(range(8)))   # completed in submit order
+        self.assertEqual(lib.max_inflight, 3)
+        self.assertEqual(lib.cancel_count, 0)
+        self.assertEqual(lib.errors, [ ])
+
+    def test_short_write(self):
+        lib = FakeLib(short = { 1: 3 })
+        with self.assertRaises(USBError) as ctx:
+            self.write(lib, 30)
+        self.assertIn('incomplete', str(ctx.exception))
+        self.assertEqual(lib.cancel_count, 1)
+        self.assertEqual(lib.inflight(), [ ])
+        # requests queued after short one are cancelled and waited without timeout
+        self.assertEqual(lib.waits[:2], [ (0, 1000), (1, 1000) ])
+        self.assertEqual(lib.waits[2:], [ (2, INFINITE), (3, INFINITE) ])
+        self.assertEqual(len(lib.requests), 4)
+        self.assertEqual(lib.errors, [ ])
+
+    def test_wait_timeout(self):
+        lib = FakeLib(timeout = { 2 })
+        with self.assertRaises(USBTimeoutError):
+            self.write(lib, 30)
+        self.assertEqual(lib.cancel_count, 1)
+        self.assertEqual(lib.inflight(), [ ])
+        self.assertEqual(lib.waits[:3], [ (0, 1000), (1, 1000), (2, 1000) ])
+        # timed out request stays pending until CancelIo completes it
+        self.assertEqual(lib.waits[3:], [ (2, INFINITE), (3, INFINITE), (4, INFINITE) ])
+        self.assertEqual(lib.requests[2][3], 'cancelled')
+        self.assertEqual(lib.errors, [ ])
+
+    def test_single_transfer_fallback(self):
+        lib = FakeLib()
+        with mock.patch.object(ggsomc._GordonGateUsb, 'bulk_write', return_value = 4) as bulk_write:
+            size, data = self.write(lib, 4)
+        self.assertEqual(size, 4)
+        bulk_write.assert_called_once()
+        self.assertEqual(lib.requests, [ ])
+
+
+if __name__ == '__main__':
+    unittest.main()